@@ -0,0 +1,311 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+import openai
+from dotenv import load_dotenv
+from tenacity import Retrying, retry_if_exception_type, stop_after_attempt, stop_after_delay, wait_random_exponential
+import jobs
+import llm
+import metrics
+from circuit_breaker import CircuitOpen
+from context_window import PoemContext
+from fallback_poet import fallback_poem, FALLBACK_SOURCE
+from partial_json import PartialObject
+from poem_history import PoemHistory
+from question_batcher import answer_queries
+from usage_ledger import BudgetExceeded
+
+# Shared by every app: prompts, poem options, tools, model calls and a response cache.
+# Python imports this module once per process, so every session of an app reuses the same warm
+# resources. Each `streamlit run` is a process of its own: two apps started separately do not
+# share clients, caches, pools or metrics.
+
+load_dotenv()
+openai.api_key = os.getenv("OPENAI_API_KEY")
+
+# Attempts per upstream operation. Only rate-limited attempts are retried, after a randomized
+# exponential backoff of up to RETRY_BACKOFF_MAX seconds; failing upstreams (5xx, connection errors)
+# are left to the circuit breaker, so retries never pile load onto them. All attempts of an
+# operation share one deadline
+RETRY_ATTEMPTS = 3
+RETRY_BACKOFF_MAX = 8
+
+# Errors that mean the API itself is failing (connection errors and timeouts, 5xx, rate limits)
+UPSTREAM_ERRORS = (openai.APIConnectionError, openai.InternalServerError, openai.RateLimitError)
+
+# Identical intent classifications and general questions are answered from this cache
+CACHE_SIZE = int(os.getenv("SUBLIME_CACHE_SIZE", "256"))
+CACHE_TTL = float(os.getenv("SUBLIME_CACHE_TTL", "600"))
+
+POET_PROMPT = "You are a creative poet."
+POEM_ANALYST_PROMPT = "You are a helpful assistant that analyzes poems."
+CLASSIFIER_PROMPT = "You are a helpful assistant that classifies user queries. Make sure that you are able to identify what services user is asking to render, there may be many services at once that user wants."
+ROUTER_PROMPT = "You are a poetic agent who analyzes the user query and then routes their query to available functions to generate the output."
+EXTRACTOR_PROMPT = "You extract the details of a poem request from the user's query."
+GENERAL_PROMPT = "You are a helpful assistant. Take user query and output relevant answer. If you don't know the answer, like a good AI assistant say, 'Sorry! I don't know the answer!'"
+
+GPT_SOURCE = "This poem is an original creation by GPT-4"
+
+STYLES = ["classic", "modern", "haiku", "free verse", "sonnet", "limerick"]
+MOODS = ["happy", "sad", "romantic", "inspirational", "nostalgic"]
+PURPOSES = [
+    "a gift", "personal reflection", "a celebration", "a memorial", "a story",
+    "parents", "siblings", "lovers", "friends", "children",
+    "colleagues", "a special occasion", "a wedding", "an anniversary",
+    "a birthday", "a graduation", "a farewell", "encouragement",
+    "appreciation", "apology", "condolence", "retirement",
+    "a boss", "a team manager", "professional recognition", "a work anniversary", "leisure time"
+]
+TONES = ["formal", "informal", "serious", "humorous", "sentimental", "playful"]
+
+# Tool registry used to route free-form queries; every app maps the names to its own handlers
+TOOLS = {
+    "generate_poem": {
+        "description": "Generate a poem with specified details: style, mood, purpose, tone.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "prompt": {"type": "string"},
+                "style": {"type": "string"},
+                "mood": {"type": "string"},
+                "purpose": {"type": "string"},
+                "tone": {"type": "string"}
+            },
+            "required": ["prompt"]
+        }
+    },
+    "trim_poem": {"description": "Trim a poem by merging alternate lines."},
+    "recapitalize": {"description": "Capitalize the text as required and turn it into uppercase."},
+    "decapitalize": {"description": "Decapitalize the text as required and turn it into lowercase."},
+    "handle_poem_query": {
+        "description": "Handles user queries about the generated poem.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "user_query": {"type": "string"}
+            },
+            "required": ["user_query"]
+        }
+    }
+}
+
+# History label recorded for each editing tool
+EDIT_LABELS = {"trim_poem": "trimmed", "recapitalize": "capitalized", "decapitalize": "decapitalized"}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+# Function to trim the poem by merging alternate lines
+def trim_poem(poem):
+    lines = poem.strip().split('\n')
+    trimmed_poem = []
+    for i in range(0, len(lines), 2):
+        if i + 1 < len(lines):
+            trimmed_poem.append(lines[i] + " " + lines[i + 1])
+        else:
+            trimmed_poem.append(lines[i])
+    return '\n'.join(trimmed_poem)
+
+# Function to recapitalize text
+def recapitalize(text):
+    return text.upper()
+
+# Function to decapitalize text
+def decapitalize(text):
+    return text.lower()
+
+# Edits a poem version can be rebuilt from
+POEM_OPERATIONS = {"trimmed": trim_poem, "capitalized": recapitalize, "decapitalized": decapitalize}
+
+# Rebuild the session objects saved with to_dict(), for restore_session
+SESSION_DECODERS = {
+    "poem_history": lambda data: PoemHistory.from_dict(data, POEM_OPERATIONS),
+    "poem_context": PoemContext.from_dict,
+}
+
+
+def new_poem_history():
+    return PoemHistory(POEM_OPERATIONS)
+
+
+def new_poem_context():
+    return PoemContext(POEM_ANALYST_PROMPT)
+
+
+def _retrying():
+    return Retrying(
+        stop=stop_after_attempt(RETRY_ATTEMPTS) | stop_after_delay(llm.DEFAULT_DEADLINE),
+        wait=wait_random_exponential(multiplier=0.5, max=RETRY_BACKOFF_MAX),
+        retry=retry_if_exception_type(openai.RateLimitError),
+        sleep=_backoff,
+        reraise=True,
+    )
+
+
+# Function to wait between attempts; a cancelled job stops waiting at once
+def _backoff(seconds):
+    job = jobs.current_job()
+    if job is None:
+        time.sleep(seconds)
+    elif job.cancel_event.wait(seconds):
+        raise llm.RequestCancelled("cancelled while waiting to retry")
+
+
+# Function to get what is left of an operation's deadline for its next attempt
+def _time_left(operation, expires_at):
+    left = expires_at - time.monotonic()
+    if left <= 0:
+        metrics.incr(f"llm.{operation}.deadline_exceeded")
+        raise llm.DeadlineExceeded(f"{operation} did not finish within {llm.DEFAULT_DEADLINE:g}s")
+    return left
+
+
+# Function to call the model with the shared retry policy
+def chat(operation, messages, **kwargs):
+    expires_at = time.monotonic() + llm.DEFAULT_DEADLINE
+    for attempt in _retrying():
+        with attempt:
+            return llm.chat(operation, messages=messages, deadline=_time_left(operation, expires_at), **kwargs)
+
+
+# Function to stream tool calls; each call's arguments are reported as progress of the current
+# job as soon as a field is complete, so the UI can use them before the reply ends
+def _stream_tool_calls(operation, messages, tools, tool_choice, deadline):
+    calls = {}
+    for chunk in llm.stream_chat(operation, messages=messages, deadline=deadline, tools=tools, tool_choice=tool_choice):
+        if not chunk.choices:
+            continue
+        for delta in chunk.choices[0].delta.tool_calls or []:
+            if delta.index not in calls:
+                calls[delta.index] = (delta.function.name, PartialObject())
+            name, arguments = calls[delta.index]
+            if delta.function.arguments and arguments.feed(delta.function.arguments):
+                jobs.report_progress(tool=name, arguments=dict(arguments.fields))
+    return [(name, arguments.result()) for _, (name, arguments) in sorted(calls.items())]
+
+
+# Function to return a cached answer for the same operation and input, or compute and cache it
+def cached(operation, key, fn):
+    key = (operation, " ".join(key.lower().split()))
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is not None and now - entry[0] < CACHE_TTL:
+            _cache.move_to_end(key)
+            metrics.incr(f"cache.{operation}.hits")
+            return entry[1]
+    metrics.incr(f"cache.{operation}.misses")
+    value = fn()
+    with _cache_lock:
+        _cache[key] = (time.monotonic(), value)
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return value
+
+
+# Function to build the tool list for the chat API, optionally limited to some tool names
+def tool_specs(names=None):
+    return [
+        {"type": "function", "function": dict(name=name, **spec)}
+        for name, spec in TOOLS.items() if names is None or name in names
+    ]
+
+
+# Function to ask the model which tools a query needs; returns (name, arguments) pairs.
+# While the reply streams in, the current job's progress holds the latest tool and its arguments
+def route(user_query, tool_choice="auto"):
+    messages = [
+        {"role": "system", "content": ROUTER_PROMPT},
+        {"role": "user", "content": user_query}
+    ]
+    expires_at = time.monotonic() + llm.DEFAULT_DEADLINE
+    for attempt in _retrying():
+        with attempt:
+            return _stream_tool_calls("conversation", messages, tool_specs(), tool_choice, _time_left("conversation", expires_at))
+
+
+# Function to extract details matching a JSON schema from a query; fields stream in as progress
+def extract(operation, name, schema, user_query):
+    messages = [
+        {"role": "system", "content": EXTRACTOR_PROMPT},
+        {"role": "user", "content": user_query}
+    ]
+    tools = [{"type": "function", "function": {"name": name, "parameters": schema}}]
+    tool_choice = {"type": "function", "function": {"name": name}}
+    expires_at = time.monotonic() + llm.DEFAULT_DEADLINE
+    for attempt in _retrying():
+        with attempt:
+            calls = _stream_tool_calls(operation, messages, tools, tool_choice, _time_left(operation, expires_at))
+            return calls[0][1] if calls else {}
+
+
+# Function to tell whether routed arguments name a valid choice for every poem option, so the
+# poem can be written without waiting for the user
+def poem_args_complete(args):
+    return (bool(args.get("prompt")) and args.get("style") in STYLES and args.get("mood") in MOODS
+            and args.get("purpose") in PURPOSES and args.get("tone") in TONES)
+
+
+# Function to generate a poem; in degraded mode, past the usage budget, or when the API is down
+# and retrying did not help, the local fallback poet writes it instead
+def generate_poem(prompt, style=None, mood=None, purpose=None, tone=None):
+    prompt_details = f"Create a {style} poem with a {mood} mood for {purpose} in a {tone} tone:\n{prompt}"
+    try:
+        response = chat(
+            "generate_poem",
+            messages=[
+                {"role": "system", "content": POET_PROMPT},
+                {"role": "user", "content": prompt_details}
+            ]
+        )
+    except (llm.DeadlineExceeded, CircuitOpen, BudgetExceeded, *UPSTREAM_ERRORS) as e:
+        return fallback_poem(prompt, style, mood, purpose, tone, reason=type(e).__name__), FALLBACK_SOURCE
+    return response.choices[0].message.content.strip(), GPT_SOURCE
+
+
+# Function to handle queries about the poem; earlier turns come from the session's context
+def handle_poem_query(poem, user_query, context):
+    return handle_poem_queries(poem, [user_query], context)[0]
+
+
+# Function to handle several queries about the poem at once, so their questions share model calls
+def handle_poem_queries(poem, user_queries, context):
+    return answer_queries(poem, user_queries, context, call=partial(chat, "handle_poem_query"))
+
+
+# Function to determine the intents of the user's query
+def determine_intent(user_query):
+    # A copy, so a session changing its intents cannot change the cached ones
+    return list(cached("determine_intent", user_query, partial(_classify, user_query)))
+
+
+def _classify(user_query):
+    prompt = f"Classify the following user query into one or more of these categories: generate a poem, trim a poem, capitalize text, decapitalize text, poem query, general query.\n\nUser query: {user_query}\n\nCategories (comma-separated if multiple):"
+    response = chat(
+        "determine_intent",
+        messages=[
+            {"role": "system", "content": CLASSIFIER_PROMPT},
+            {"role": "user", "content": prompt}
+        ]
+    )
+    return response.choices[0].message.content.strip().lower().replace("then", ",").replace("and", ",").split(', ')
+
+
+# Function to answer a general query that is not about the poem
+def answer_general_query(user_query):
+    return cached("general_query", user_query, partial(_answer_general, user_query))
+
+
+def _answer_general(user_query):
+    response = chat(
+        "general_query",
+        messages=[
+            {"role": "system", "content": GENERAL_PROMPT},
+            {"role": "user", "content": user_query}
+        ]
+    )
+    return response.choices[0].message.content.strip()
@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import uuid
+from context_window import PoemContext
+from poem_history import PoemHistory
+from session_store import SessionStore, diff
+
+WORDS = (
+    "the light falls on a quiet river where the old willow keeps its secret and every morning "
+    "sings of summer rain across the golden meadow while the speaker remembers a distant home "
+    "meter rhyme stanza iambic imagery metaphor tone voice line verse longing hope grief"
+).split()
+
+POEM_OPERATIONS = {"trimmed": lambda text: text, "capitalized": str.upper, "decapitalized": str.lower}
+
+
+def _sentence(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def _poem(rng):
+    return "\n".join(_sentence(rng, 8) for _ in range(14))
+
+
+# Function to play one session turn by turn, yielding its state the way the apps save it
+def _session_states(turns, seed):
+    rng = random.Random(seed)
+    history = PoemHistory(POEM_OPERATIONS)
+    context = PoemContext("You are a helpful assistant that analyzes poems.")
+    log = []
+    for turn in range(turns):
+        question = _sentence(rng, 10)
+        log.append({"id": str(uuid.UUID(int=rng.getrandbits(128))), "role": "user", "content": question})
+        if turn % 10 == 0:
+            version = history.add(_poem(rng))
+            log.append({"id": str(uuid.UUID(int=rng.getrandbits(128))), "role": "system", "version": version})
+        elif turn % 10 in (3, 6):
+            version = history.apply(rng.choice(list(POEM_OPERATIONS)))
+            log.append({"id": str(uuid.UUID(int=rng.getrandbits(128))), "role": "system", "version": version})
+        else:
+            answer = " ".join(_sentence(rng, 12) for _ in range(4))
+            context.messages(history.text(), question)
+            context.record(question, answer)
+            log.append({"id": str(uuid.UUID(int=rng.getrandbits(128))), "role": "system", "content": answer})
+        yield {
+            "poem_history": history.to_dict(),
+            "poem_context": context.to_dict(),
+            "conversation_log": log,
+            "intents": ["poem query"],
+            "actions_done": ["poem query"],
+        }
+
+
+def _file_size(store, token):
+    return os.path.getsize(store.path(token))
+
+
+# Function to measure incremental saving, on-disk size and restore time for one session length
+def bench(turns, restores):
+    directory = tempfile.mkdtemp(prefix="sublime-bench-")
+    try:
+        store = SessionStore(directory)
+        token = str(uuid.uuid4())
+        previous = {}
+        save_times = []
+        for state in _session_states(turns, seed=turns):
+            # The same path as save_session: the state holds the session's live objects, and the
+            # snapshot returned by save() is what the next save is diffed against
+            start = time.perf_counter()
+            previous = store.save(token, previous, state)
+            save_times.append(time.perf_counter() - start)
+
+        raw = len(json.dumps(previous, separators=(",", ":")).encode())
+        on_disk = _file_size(store, token)
+        restore_times = []
+        for _ in range(restores):
+            start = time.perf_counter()
+            restored = store.load(token)
+            PoemHistory.from_dict(restored["poem_history"], POEM_OPERATIONS)
+            PoemContext.from_dict(restored["poem_context"])
+            restore_times.append(time.perf_counter() - start)
+        assert restored == previous and diff(restored, previous) is None
+
+        return {
+            "turns": turns,
+            "raw_json_kb": raw / 1024,
+            "snapshot_kb": on_disk / 1024,
+            "ratio": raw / on_disk,
+            "save_ms_p50": statistics.median(save_times) * 1000,
+            "save_ms_max": max(save_times) * 1000,
+            "restore_ms_p50": statistics.median(restore_times) * 1000,
+        }
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark session snapshot size and restore time")
+    parser.add_argument("--turns", type=int, nargs="+", default=[100, 300, 1000])
+    parser.add_argument("--restores", type=int, default=20)
+    args = parser.parse_args()
+
+    columns = ["turns", "raw_json_kb", "snapshot_kb", "ratio", "save_ms_p50", "save_ms_max", "restore_ms_p50"]
+    print(" ".join(f"{column:>15}" for column in columns))
+    for turns in args.turns:
+        result = bench(turns, args.restores)
+        print(" ".join(f"{result[column]:>15.2f}" if isinstance(result[column], float) else f"{result[column]:>15}" for column in columns))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+from collections import deque
+import metrics
+
+# Rolling window, in seconds, over which errors and slow calls are counted
+WINDOW_SECONDS = float(os.getenv("SUBLIME_BREAKER_WINDOW", "60"))
+
+# Fewest calls in the window before the breaker may open
+MIN_CALLS = int(os.getenv("SUBLIME_BREAKER_MIN_CALLS", "5"))
+
+# The breaker opens when this share of calls in the window failed or was too slow
+FAILURE_RATE_THRESHOLD = float(os.getenv("SUBLIME_BREAKER_FAILURE_RATE", "0.5"))
+SLOW_CALL_SECONDS = float(os.getenv("SUBLIME_BREAKER_SLOW_CALL", "45"))
+
+# How long the breaker stays open before letting probe requests through
+OPEN_SECONDS = float(os.getenv("SUBLIME_BREAKER_OPEN_SECONDS", "30"))
+
+# Probe requests allowed while half-open; all must succeed to close the breaker again
+HALF_OPEN_PROBES = int(os.getenv("SUBLIME_BREAKER_PROBES", "2"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+# Raised instead of calling the upstream while the breaker is open
+class CircuitOpen(Exception):
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable, retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+# Tracks the health of one upstream (model/endpoint) for every session in the process
+class CircuitBreaker:
+    def __init__(self, name):
+        self.name = name
+        self.state = CLOSED
+        self.opened_at = None
+        self._calls = deque()
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self._lock = threading.Lock()
+
+    # Function to ask for permission before a call; raises CircuitOpen when failing fast
+    def before_call(self):
+        with self._lock:
+            if self.state == OPEN:
+                retry_after = self.opened_at + OPEN_SECONDS - time.monotonic()
+                if retry_after > 0:
+                    metrics.incr(f"breaker.{self.name}.rejected")
+                    raise CircuitOpen(self.name, retry_after)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight + self._probe_successes >= HALF_OPEN_PROBES:
+                    metrics.incr(f"breaker.{self.name}.rejected")
+                    raise CircuitOpen(self.name, 1)
+                self._probes_in_flight += 1
+                metrics.incr(f"breaker.{self.name}.probes")
+
+    # Function to report how a permitted call went
+    def after_call(self, ok, latency):
+        with self._lock:
+            now = time.monotonic()
+            slow = latency >= SLOW_CALL_SECONDS
+            self._calls.append((now, ok and not slow))
+            self._trim(now)
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+                if not ok or slow:
+                    self._transition(OPEN)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= HALF_OPEN_PROBES:
+                        self._transition(CLOSED)
+            elif self.state == CLOSED and len(self._calls) >= MIN_CALLS:
+                if self.failure_rate() >= FAILURE_RATE_THRESHOLD:
+                    self._transition(OPEN)
+
+    # Function to release a probe slot when a call ends without a verdict, e.g. it was cancelled
+    def release(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes_in_flight = max(self._probes_in_flight - 1, 0)
+
+    def failure_rate(self):
+        if not self._calls:
+            return 0.0
+        return sum(1 for _, ok in self._calls if not ok) / len(self._calls)
+
+    def snapshot(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            retry_after = None
+            if self.state == OPEN:
+                retry_after = max(self.opened_at + OPEN_SECONDS - time.monotonic(), 0)
+            return {
+                "state": self.state,
+                "calls": len(self._calls),
+                "failure_rate": self.failure_rate(),
+                "retry_after": retry_after,
+            }
+
+    def _trim(self, now):
+        while self._calls and now - self._calls[0][0] > WINDOW_SECONDS:
+            self._calls.popleft()
+
+    def _transition(self, state):
+        self.state = state
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        if state == CLOSED:
+            self._calls.clear()
+        metrics.incr(f"breaker.{self.name}.{state}")
+
+
+# Function to get the shared breaker for an upstream, creating it on first use
+def get_breaker(name):
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name)
+        return _breakers[name]
+
+
+# Function to list the state of every breaker, for metrics and the UI
+def breaker_states():
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
@@ -0,0 +1,172 @@
+import math
+import os
+import re
+import threading
+import metrics
+
+# Tokens allowed for earlier question/answer turns; older turns are folded into a summary
+HISTORY_BUDGET = int(os.getenv("SUBLIME_CONTEXT_BUDGET", "1500"))
+
+# Tokens allowed for the summary of folded turns; its oldest lines are dropped first
+SUMMARY_BUDGET = int(os.getenv("SUBLIME_SUMMARY_BUDGET", "300"))
+
+# Per-message overhead of the chat format (role and separators)
+MESSAGE_OVERHEAD = 4
+
+# Longest answer excerpt kept for a folded turn, in words
+GIST_WORDS = 30
+
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+
+# Function to estimate the token count of a text locally: short words are one token,
+# longer words roughly one per four characters, and each punctuation mark is its own token
+def count_tokens(text):
+    return sum(max(1, math.ceil(len(piece) / 4)) for piece in _TOKEN_PATTERN.findall(text or ""))
+
+
+def message_tokens(messages):
+    return sum(count_tokens(message["content"]) + MESSAGE_OVERHEAD for message in messages)
+
+
+def _gist(question, answer):
+    sentence = re.split(r"(?<=[.!?])\s", answer.strip(), maxsplit=1)[0]
+    words = sentence.split()
+    if len(words) > GIST_WORDS:
+        sentence = " ".join(words[:GIST_WORDS]) + "..."
+    return f"- Q: {question.strip()} A: {sentence}"
+
+
+# Follow-up context for questions about a poem. Every prompt starts with the same system prompt
+# and poem, so the provider can cache that prefix; recent turns follow verbatim and older turns
+# are summarized to keep the prompt within budget. Background jobs of one session may share a
+# context, so its methods hold the context's lock
+class PoemContext:
+    def __init__(self, system_prompt, history_budget=HISTORY_BUDGET, summary_budget=SUMMARY_BUDGET):
+        self.system_prompt = system_prompt
+        self.history_budget = history_budget
+        self.summary_budget = summary_budget
+        self.poem_id = None
+        self.turns = []
+        self.summary = []
+        self.folded_turns = 0
+        self._folded_tokens = 0
+        self.last_report = None
+        self._lock = threading.RLock()
+
+    # Function to export the turns and summary for a session snapshot
+    def to_dict(self):
+        with self._lock:
+            return {
+                "system_prompt": self.system_prompt,
+                "poem_id": self.poem_id,
+                "turns": [list(turn) for turn in self.turns],
+                "summary": list(self.summary),
+                "folded_turns": self.folded_turns,
+                "folded_tokens": self._folded_tokens,
+                "last_report": self.last_report,
+            }
+
+    # Function to rebuild a context from to_dict() output
+    @classmethod
+    def from_dict(cls, data, history_budget=HISTORY_BUDGET, summary_budget=SUMMARY_BUDGET):
+        context = cls(data["system_prompt"], history_budget, summary_budget)
+        context.poem_id = data.get("poem_id")
+        context.turns = [tuple(turn) for turn in data["turns"]]
+        context.summary = list(data["summary"])
+        context.folded_turns = data["folded_turns"]
+        context._folded_tokens = data["folded_tokens"]
+        context.last_report = data["last_report"]
+        return context
+
+    # Function to say which poem the next questions are about. Turns about a different poem are
+    # dropped, so they are neither replayed nor summarized for it; edits of the same poem (its
+    # trimmed or recapitalized versions) share one id and keep the conversation going
+    def use_poem(self, poem_id):
+        with self._lock:
+            if poem_id == self.poem_id:
+                return
+            self.poem_id = poem_id
+            self.turns = []
+            self.summary = []
+            self.folded_turns = 0
+            self._folded_tokens = 0
+            self.last_report = None
+
+    # Function to build the messages for a new question about the poem
+    def messages(self, poem, question):
+        prefix = [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": f"Here is a poem:\n\n{poem}\n\nI will ask questions about the poem. Answer them in a helpful manner."},
+        ]
+        with self._lock:
+            recent = self._fit_turns()
+            summary = []
+            if self.summary:
+                summary = [{"role": "system", "content": "Earlier in this conversation:\n" + "\n".join(self.summary)}]
+            messages = prefix + summary + recent + [{"role": "user", "content": question}]
+
+            # What resending every earlier turn verbatim would have cost, for comparison
+            full_history = message_tokens(prefix) + self._history_tokens() + count_tokens(question) + MESSAGE_OVERHEAD
+            sent = message_tokens(messages)
+            self.last_report = {
+                "prompt_tokens": sent,
+                "prefix_tokens": message_tokens(prefix),
+                "recent_turns": len(recent) // 2,
+                "summarized_turns": self.folded_turns,
+                "full_history_tokens": full_history,
+            }
+        metrics.observe("context.prompt_tokens", sent)
+        metrics.incr("context.calls")
+        metrics.incr("context.tokens_sent", sent)
+        metrics.incr("context.tokens_full_history", full_history)
+        return messages
+
+    # Function to remember a finished turn; usage is the response's token usage, when available
+    def record(self, question, answer, usage=None):
+        with self._lock:
+            self.turns.append((question, answer))
+            if usage is not None and self.last_report is not None:
+                details = getattr(usage, "prompt_tokens_details", None)
+                cached = getattr(details, "cached_tokens", None) or 0
+                self.last_report["usage_prompt_tokens"] = usage.prompt_tokens
+                self.last_report["cached_tokens"] = cached
+                metrics.incr("context.usage_prompt_tokens", usage.prompt_tokens)
+                metrics.incr("context.cached_tokens", cached)
+
+    def _history_tokens(self):
+        return sum(self._turn_tokens(turn) for turn in self.turns) + self._folded_tokens
+
+    def _turn_tokens(self, turn):
+        return count_tokens(turn[0]) + count_tokens(turn[1]) + 2 * MESSAGE_OVERHEAD
+
+    # Keeps the newest turns that fit the budget and folds the rest into the summary for good
+    def _fit_turns(self):
+        used = 0
+        fold = len(self.turns)
+        while fold > 0 and used + self._turn_tokens(self.turns[fold - 1]) <= self.history_budget:
+            used += self._turn_tokens(self.turns[fold - 1])
+            fold -= 1
+        for turn in self.turns[:fold]:
+            self._folded_tokens += self._turn_tokens(turn)
+            self.summary.append(_gist(*turn))
+            self.folded_turns += 1
+        self.turns = self.turns[fold:]
+        while self.summary and count_tokens("\n".join(self.summary)) > self.summary_budget:
+            self.summary.pop(0)
+
+        recent = []
+        for question, answer in self.turns:
+            recent.append({"role": "user", "content": question})
+            recent.append({"role": "assistant", "content": answer})
+        return recent
+
+
+# Function to describe a prompt report in one line for the UI
+def describe_report(report):
+    if not report:
+        return ""
+    text = f"Prompt: ~{report['prompt_tokens']} tokens (~{report['full_history_tokens']} if the whole conversation were resent)"
+    if report.get("cached_tokens"):
+        text += f", {report['cached_tokens']} served from the provider's prompt cache"
+    return text
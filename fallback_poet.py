@@ -0,0 +1,190 @@
+import random
+import re
+import threading
+import time
+import zlib
+import metrics
+
+# The fallback must answer well within this many seconds, without any network access
+LATENCY_BUDGET = 0.05
+
+# Caption shown next to every poem written by the fallback
+FALLBACK_SOURCE = "Degraded mode: written offline by the local fallback poet while GPT-4 is unavailable"
+
+STOPWORDS = {
+    "a", "an", "the", "and", "or", "but", "about", "for", "of", "on", "in", "to", "with", "my", "me",
+    "i", "you", "your", "our", "we", "is", "it", "this", "that", "write", "create", "generate", "make",
+    "poem", "poems", "please", "some", "something", "give", "can", "could", "would", "want", "like",
+}
+
+MOOD_WORDS = {
+    "happy": {
+        "adj": ["golden", "bright", "laughing", "warm", "sunlit", "merry"],
+        "noun": ["morning", "meadow", "lantern", "garden", "river", "sparrow"],
+        "verb": ["dances", "shines", "sings", "glows", "rises", "sparkles"],
+    },
+    "sad": {
+        "adj": ["quiet", "faded", "lonely", "grey", "hollow", "weary"],
+        "noun": ["candle", "window", "shadow", "letter", "harbour", "willow"],
+        "verb": ["lingers", "fades", "waits", "weeps", "falls", "trembles"],
+    },
+    "romantic": {
+        "adj": ["tender", "velvet", "secret", "gentle", "moonlit", "burning"],
+        "noun": ["rose", "whisper", "promise", "ember", "letter", "garden"],
+        "verb": ["blooms", "lingers", "glows", "whispers", "waits", "burns"],
+    },
+    "inspirational": {
+        "adj": ["steady", "fearless", "rising", "boundless", "unbroken", "bright"],
+        "noun": ["mountain", "summit", "compass", "ember", "river", "horizon"],
+        "verb": ["climbs", "rises", "endures", "carries", "builds", "soars"],
+    },
+    "nostalgic": {
+        "adj": ["old", "amber", "dusty", "distant", "familiar", "faded"],
+        "noun": ["photograph", "porch", "summer", "schoolyard", "record", "attic"],
+        "verb": ["remembers", "returns", "echoes", "lingers", "drifts", "waits"],
+    },
+}
+
+# Line endings grouped by rhyme, so rhymed forms can pick a consistent sound
+RHYMES = [
+    ["light", "night", "sight", "flight", "height"],
+    ["day", "way", "bay", "spray", "ray"],
+    ["sea", "tree", "lea", "key"],
+    ["heart", "art", "start", "chart"],
+    ["rain", "lane", "plain", "chain", "grain"],
+    ["sky", "sigh", "eye", "lullaby"],
+    ["door", "shore", "floor", "core", "oar"],
+    ["home", "foam", "loam", "dome"],
+]
+
+RHYMED_LINES = [
+    "The {adj} {noun} {verb} beneath the {end}",
+    "where the {topic} {verb} beside the {end}",
+    "and every {noun} {verb} toward the {end}",
+    "a {adj} {noun} that {verb} across the {end}",
+    "as the {topic} {verb} against the {end}",
+    "so the {adj} {topic} {verb} into the {end}",
+]
+
+FREE_LINES = [
+    "The {topic} {verb}",
+    "like a {adj} {noun} no one has named yet",
+    "I keep the {topic} the way a {noun} keeps its {adj} hour",
+    "somewhere a {noun} {verb}",
+    "and the {adj} {topic} answers",
+    "{adj}, {adj2}, the {noun} {verb} again",
+]
+
+HAIKU_LINES = [
+    ["{adj} {noun} at dawn", "the {topic} in {adj} light", "one {noun} alone"],
+    ["the {topic} {verb}", "a {adj} {noun} holds its breath", "{noun} after rain"],
+]
+
+# Forms with a fixed number of lines, which a tone closing or dedication line would break
+FIXED_FORMS = {"haiku", "limerick", "sonnet"}
+
+TONE_CLOSINGS = {
+    "formal": "Thus shall the {topic} endure.",
+    "informal": "that's the {topic}, more or less.",
+    "serious": "And the {topic} remains.",
+    "humorous": "(the {topic} insists this rhymes, it does not)",
+    "sentimental": "and I will hold the {topic} close.",
+    "playful": "la-di-da, the {topic} goes round!",
+}
+
+_extra_adjectives = {}
+
+
+# Function to enrich the mood adjectives with WordNet synonyms, if the nltk corpus is installed
+def _load_wordnet_synonyms():
+    try:
+        from nltk.corpus import wordnet
+        for mood in MOOD_WORDS:
+            lemmas = {
+                lemma.name().replace("_", " ")
+                for synset in wordnet.synsets(mood, pos=wordnet.ADJ)
+                for lemma in synset.lemmas()
+            }
+            _extra_adjectives[mood] = sorted(word for word in lemmas if word != mood and " " not in word)
+    except (ImportError, LookupError):
+        pass
+
+
+# Loading the corpus is slow, so it happens once in the background and never on the request path
+threading.Thread(target=_load_wordnet_synonyms, name="fallback-wordnet", daemon=True).start()
+
+
+def _topics(prompt):
+    words = [word.lower() for word in re.findall(r"[A-Za-z']+", prompt or "")]
+    topics = [word for word in words if len(word) > 2 and word not in STOPWORDS]
+    return topics or ["world"]
+
+
+def _fill(template, rng, words, topics):
+    adjectives = words["adj"] + _extra_adjectives.get(words["mood"], [])
+    return template.format(
+        adj=rng.choice(adjectives),
+        adj2=rng.choice(adjectives),
+        noun=rng.choice(words["noun"]),
+        verb=rng.choice(words["verb"]),
+        topic=rng.choice(topics),
+        end="{end}",
+    )
+
+
+# Every rhyme letter of the scheme gets a rhyme group of its own, so "ABAB CDCD" never collapses
+# into one sound
+def _rhymed(rng, words, topics, scheme):
+    letters = sorted(set(scheme) - {" "})
+    groups = dict(zip(letters, rng.sample(RHYMES, len(letters))))
+    ends = {}
+    lines = []
+    for letter in scheme:
+        if letter == " ":
+            lines.append("")
+            continue
+        if letter not in ends:
+            group = groups[letter]
+            ends[letter] = rng.sample(group, len(group))
+        end = ends[letter].pop(0) if len(ends[letter]) > 1 else ends[letter][0]
+        lines.append(_fill(rng.choice(RHYMED_LINES), rng, words, topics).format(end=end))
+    return lines
+
+
+def _compose(rng, style, words, topics):
+    if style == "haiku":
+        return [_fill(line, rng, words, topics) for line in rng.choice(HAIKU_LINES)]
+    if style == "limerick":
+        return _rhymed(rng, words, topics, "AABBA")
+    if style == "sonnet":
+        return _rhymed(rng, words, topics, "ABAB CDCD EFEF GG")
+    if style == "classic":
+        return _rhymed(rng, words, topics, "ABAB CDCD")
+    count = rng.randint(6, 8)
+    return [_fill(rng.choice(FREE_LINES), rng, words, topics) for _ in range(count)]
+
+
+# Function to write a poem locally, from templates and word banks, for degraded mode
+def fallback_poem(prompt, style=None, mood=None, purpose=None, tone=None, reason="deadline"):
+    start = time.perf_counter()
+    seed = zlib.crc32("|".join(str(part) for part in (prompt, style, mood, purpose, tone)).encode())
+    rng = random.Random(seed)
+    mood = mood if mood in MOOD_WORDS else "happy"
+    words = dict(MOOD_WORDS[mood], mood=mood)
+    topics = _topics(prompt)
+
+    lines = _compose(rng, style, words, topics)
+    if tone in TONE_CLOSINGS and style not in FIXED_FORMS:
+        lines.append(TONE_CLOSINGS[tone].format(topic=rng.choice(topics)))
+    lines = [re.sub(r"\b([Aa]) (?=[aeiou])", r"\1n ", line[:1].upper() + line[1:]) for line in lines]
+    if purpose and purpose != "None" and style not in FIXED_FORMS:
+        lines.append(f"— for {purpose}")
+    poem = "\n".join(lines)
+
+    elapsed = time.perf_counter() - start
+    metrics.incr("fallback.poems")
+    metrics.incr(f"fallback.reason.{reason}")
+    metrics.observe("fallback.latency", elapsed)
+    if elapsed > LATENCY_BUDGET:
+        metrics.incr("fallback.over_budget")
+    return poem
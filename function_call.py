@@ -1,243 +1,175 @@
 import streamlit as st
-from openai import OpenAI
-import openai
-import json
-
-client = OpenAI()
-
-# Function to generate poem
-def generate_poem(prompt, style=None, mood=None, purpose=None, tone=None):
-    prompt_details = f"Create a {style} poem with a {mood} mood for {purpose} in a {tone} tone:\n{prompt}"
-    response = openai.chat.completions.create(
-        model="gpt-4-turbo",
-        messages=[
-            {"role": "system", "content": "You are a creative poet."},
-            {"role": "user", "content": prompt_details}
-        ]
-    )
-    poem = response.choices[0].message.content.strip()
-    return poem
-
-# Function to trim the poem
-def trim_poem(poem):
-    lines = poem.strip().split('\n')
-    trimmed_poem = []
-    for i in range(0, len(lines), 2):
-        if i + 1 < len(lines):
-            trimmed_poem.append(lines[i] + " " + lines[i + 1])
-        else:
-            trimmed_poem.append(lines[i])
-    return '\n'.join(trimmed_poem)
-
-# Function to recapitalize text
-def recapitalize(text):
-    return text.upper()
-
-# Function to decapitalize text
-def decapitalize(text):
-    return text.lower()
-
-# Function to handle queries about the generated poem
-def handle_poem_query(poem, user_query):
-    prompt = f"Here is a poem:\n\n{poem}\n\nThe user has a question about the poem: {user_query}\n\nAnswer the question in a helpful manner:"
-    response = openai.chat.completions.create(
-        model="gpt-4-turbo",
-        messages=[
-            {"role": "system", "content": "You are a helpful assistant that analyzes poems."},
-            {"role": "user", "content": prompt}
-        ]
-    )
-    answer = response.choices[0].message.content.strip()
-    return answer
-
-def conversation(user_query):
-    messages = [
-        {"role": "system", "content": "You are a poetic agent who analyzes the user query and then accordingly routes their query to available functions and generates the output."},
-        {"role": "user", "content": user_query}
-    ]
-
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "generate_poem",
-                "description": "Generate a poem with specified details: style, mood, purpose, tone.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "prompt": {"type": "string"},
-                        "style": {"type": "string"},
-                        "mood": {"type": "string"},
-                        "purpose": {"type": "string"},
-                        "tone": {"type": "string"}
-                    },
-                    "required": ["prompt"]
-                }
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "trim_poem",
-                "description": "Trim a poem by merging alternate lines.",
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "recapitalize",
-                "description": "Capitalize the text as required and turn it into uppercase.",
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "decapitalize",
-                "description": "Decapitalize the text as required and turn it into lowercase.",
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "handle_poem_query",
-                "description": "Handles user query when user prompts a different action to be performed apart from trimming, recapitalizing, decapitalizing, and generating a poem.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "poem": {"type": "string"},
-                        "user_query": {"type": "string"}
-                    },
-                    "required": ["poem", "user_query"]
-                }
-            }
-        }
-    ]
-    response = client.chat.completions.create(
-        model="gpt-4-turbo",
-        messages=messages,
-        tools=tools,
-        tool_choice="auto"
-    )
-    response_message = response.choices[0].message
-    tool_calls = response_message.tool_calls
-    
-    available_functions = {
-        "generate_poem": generate_poem,
-        "trim_poem": trim_poem,
-        "recapitalize": recapitalize,
-        "decapitalize": decapitalize,
-        "handle_poem_query": handle_poem_query
-    }
-    if not tool_calls:
-        print("tool call broke")
+from job_widgets import start_job, cancel_session_jobs, finished_job
+from sidebar import render_sidebar
+from history_widgets import render_poem_history
+from context_window import describe_report
+from session_widgets import restore_session, save_session
+import agent_core
+from agent_core import EDIT_LABELS
+
+# Function to route the query and run the tools it needs; runs in the background worker pool.
+# Edits are only named here, the app applies them to the poem history
+def conversation(user_query, poem=None, context=None):
     results = []
-    for tool_call in tool_calls:
-        function_name = tool_call.function.name
-        function_to_call = available_functions[function_name]
-        function_args = json.loads(tool_call.function.arguments)
-        result = function_to_call(**function_args)
-        results.append({"function": function_name, "result": result})
-
+    questions = []
+    for function_name, function_args in agent_core.route(user_query):
+        entry = {"function": function_name}
+        if function_name == "generate_poem":
+            entry["result"], entry["source"] = agent_core.generate_poem(**function_args)
+        elif function_name == "handle_poem_query" and poem is None:
+            entry["result"] = "No poem available to analyze."
+        elif function_name == "handle_poem_query":
+            questions.append((entry, function_args["user_query"]))
+        results.append(entry)
+    # Every question routed from the query is answered in one batch
+    if questions:
+        answers = agent_core.handle_poem_queries(poem, [query for _, query in questions], context)
+        for (entry, _), answer in zip(questions, answers):
+            entry["result"] = answer
+    if not results:
+        print("tool call broke")
     return results
 
+# Session state written to disk, so a restart or reconnect does not lose the conversation
+SESSION_KEYS = ["poem_history", "poem_context", "conversation_results"]
+
 # Streamlit app
 def main():
     st.title("Poetic AI Agent")
+    restore_session(agent_core.SESSION_DECODERS)
+    render_sidebar()
     
-    # State management for the last generated poem
-    if 'last_poem' not in st.session_state:
-        st.session_state.last_poem = ""
+    # State management for the generated poem and its edits
+    if 'poem_history' not in st.session_state:
+        st.session_state.poem_history = agent_core.new_poem_history()
+    if 'last_query' not in st.session_state:
+        st.session_state.last_query = ""
+    if 'conversation_results' not in st.session_state:
+        st.session_state.conversation_results = []
+    if 'poem_context' not in st.session_state:
+        st.session_state.poem_context = agent_core.new_poem_context()
+
+    history = st.session_state.poem_history
 
     user_query = st.text_input("Enter your query:")
 
+    # Route a new query in the background; reruns reuse the in-flight or finished routing
+    if user_query and user_query != st.session_state.last_query:
+        st.session_state.last_query = user_query
+        st.session_state.conversation_results = []
+        cancel_session_jobs()
+        st.session_state.poem_context.use_poem(history.base())
+        start_job("conversation", conversation, user_query, history.text(), st.session_state.poem_context)
+
+    job = finished_job("conversation", "your query")
+    if job:
+        if job.error:
+            st.error(f"Could not process your query: {job.error}")
+        else:
+            # Poems are kept once in the history; results only refer to their version
+            for result in job.result:
+                if result['function'] == "generate_poem":
+                    result['version'] = history.add(result.pop('result'))
+                elif result['function'] in EDIT_LABELS and history.current is not None:
+                    result['version'] = history.apply(EDIT_LABELS[result['function']])
+                elif result['function'] in EDIT_LABELS:
+                    result['result'] = "No poem available to edit."
+                elif result['function'] == "handle_poem_query":
+                    result['prompt_report'] = describe_report(st.session_state.poem_context.last_report)
+            st.session_state.conversation_results = job.result
+
     if user_query:
-        conversation_results = conversation(user_query)
-        for result in conversation_results:
+        for result in st.session_state.conversation_results:
             function_name = result['function']
-            result_content = result['result']
+            result_content = history.text(result['version']) if 'version' in result else result['result']
             
             if function_name == "generate_poem":
-                st.session_state.last_poem = result_content
                 st.write("Generated Poem:")
                 st.write(result_content)
+                st.caption(f"Source: {result['source']}")
                 
             elif function_name == "trim_poem":
-                st.session_state.last_poem = result_content
                 st.write("Trimmed Poem:")
                 st.write(result_content)
                 
             elif function_name == "recapitalize":
-                st.session_state.last_poem = result_content
                 st.write("Recapitalized Text:")
                 st.write(result_content)
                 
             elif function_name == "decapitalize":
-                st.session_state.last_poem = result_content
                 st.write("Decapitalized Text:")
                 st.write(result_content)
                 
             elif function_name == "handle_poem_query":
                 st.write("Answer to Query:")
                 st.write(result_content)
+                st.caption(result.get('prompt_report', ""))
 
     if 'generate_poem' in user_query:
         st.subheader("Customize Your Poem")
-        style = st.selectbox("Style:", ["classic", "modern", "haiku", "free verse", "sonnet", "limerick"], key="select_style")
-        mood = st.selectbox("Mood:", ["happy", "sad", "romantic", "inspirational", "nostalgic"], key="select_mood")
-        purpose = st.selectbox("Purpose:",
-                              [
-                                  "a gift", "personal reflection", "a celebration", "a memorial", "a story",
-                                  "parents", "siblings", "lovers", "friends", "children",
-                                  "colleagues", "a special occasion", "a wedding", "an anniversary",
-                                  "a birthday", "a graduation", "a farewell", "encouragement",
-                                  "appreciation", "apology", "condolence", "retirement",
-                                  "a boss", "a team manager", "professional recognition", "a work anniversary", "leisure time"
-                              ], key="select_purpose")
-        tone = st.selectbox("Tone:", ["formal", "informal", "serious", "humorous", "sentimental", "playful"], key="select_tone")
+        style = st.selectbox("Style:", agent_core.STYLES, key="select_style")
+        mood = st.selectbox("Mood:", agent_core.MOODS, key="select_mood")
+        purpose = st.selectbox("Purpose:", agent_core.PURPOSES, key="select_purpose")
+        tone = st.selectbox("Tone:", agent_core.TONES, key="select_tone")
         prompt = st.text_area("Enter the poem prompt:")
 
         if st.button("Generate Poem"):
-            poem = generate_poem(prompt, style, mood, purpose, tone)
-            st.session_state.last_poem = poem
-            st.write("Generated Poem:")
-            st.write(poem)
+            start_job("generate_poem", agent_core.generate_poem, prompt, style, mood, purpose, tone)
+
+        job = finished_job("generate_poem", "your poem")
+        if job:
+            if job.error:
+                st.error(f"Could not generate the poem: {job.error}")
+            else:
+                poem, source = job.result
+                history.add(poem)
+                st.write("Generated Poem:")
+                st.write(poem)
+                st.caption(f"Source: {source}")
 
     if 'trim_poem' in user_query:
         st.subheader("Trim the Poem")
         if st.button("Trim Poem"):
-            if st.session_state.last_poem:
-                trimmed_poem = trim_poem(st.session_state.last_poem)
-                st.session_state.last_poem = trimmed_poem
+            if history.current is not None:
+                version = history.apply("trimmed")
                 st.write("Trimmed Poem:")
-                st.write(trimmed_poem)
+                st.write(history.text(version))
             else:
                 st.write("No poem available to trim.")
 
     if 'recapitalize' in user_query:
         st.subheader("Recapitalize Text")
-        text = st.session_state.last_poem
-        if st.button("Recapitalize"):
-            recapitalized_text = recapitalize(text)
-            st.session_state.last_poem = recapitalized_text
+        if st.button("Recapitalize") and history.current is not None:
+            version = history.apply("capitalized")
             st.write("Recapitalized Text:")
-            st.write(recapitalized_text)
+            st.write(history.text(version))
 
     if 'decapitalize' in user_query:
         st.subheader("Decapitalize Text")
-        text = st.session_state.last_poem
-        if st.button("Decapitalize"):
-            decapitalized_text = decapitalize(text)
-            st.session_state.last_poem = decapitalized_text
+        if st.button("Decapitalize") and history.current is not None:
+            version = history.apply("decapitalized")
             st.write("Decapitalized Text:")
-            st.write(decapitalized_text)
+            st.write(history.text(version))
 
     if 'handle_poem_query' in user_query:
         st.subheader("Handle Poem Query")
-        poem = st.session_state.last_poem
+        poem = history.text() or ""
         if st.button("Handle Query"):
-            answer = handle_poem_query(poem, user_query)
-            st.write("Answer to Query:")
-            st.write(answer)
+            st.session_state.poem_context.use_poem(history.base())
+            start_job("handle_poem_query", agent_core.handle_poem_query, poem, user_query, st.session_state.poem_context)
+
+        job = finished_job("handle_poem_query", "your question")
+        if job:
+            if job.error:
+                st.error(f"Could not answer the query: {job.error}")
+            else:
+                st.write("Answer to Query:")
+                st.write(job.result)
+                st.caption(describe_report(st.session_state.poem_context.last_report))
+
+    render_poem_history(history)
+
+    save_session(SESSION_KEYS)
 
 if __name__ == "__main__":
     main()
@@ -1,172 +1,78 @@
 import streamlit as st
-from openai import OpenAI
-import openai
-import json
-
-client = OpenAI()
-
-
-# Function to generate poem
-def generate_poem(prompt, default_style=None, default_mood=None, default_purpose=None, default_tone=None):
+from job_widgets import start_job, cancel_session_jobs, cancel_job, finished_job, job_progress
+from sidebar import render_sidebar
+from history_widgets import render_poem_history
+from question_widgets import ask_poem_question, finished_poem_questions, open_poem_questions
+from context_window import describe_report
+from session_widgets import restore_session, save_session
+import agent_core
+
+
+# Function to show the poem options, pre-selected from the arguments the query was routed with;
+# they may still be streaming in, and the poem is started as soon as every option is known
+def generate_poem(prompt=None, style=None, mood=None, purpose=None, tone=None):
     st.subheader("Customize Your Poem:")
+    routed_complete = agent_core.poem_args_complete(dict(prompt=prompt, style=style, mood=mood, purpose=purpose, tone=tone))
     
-    style_options = ["classic", "modern", "haiku", "free verse", "sonnet", "limerick", "None"]
-    mood_options = ["happy", "sad", "romantic", "inspirational", "nostalgic", "None"]
-    purpose_options = [ 
-        "a gift", "personal reflection", "a celebration", "a memorial", "a story",
-        "parents", "siblings", "lovers", "friends", "children",
-        "colleagues", "a special occasion", "a wedding", "an anniversary",
-        "a birthday", "a graduation", "a farewell", "encouragement",
-        "appreciation", "apology", "condolence", "retirement",
-        "a boss", "a team manager", "professional recognition", "a work anniversary", "leisure time", "None"
-    ]
-    tone_options = ["formal", "informal", "serious", "humorous", "sentimental", "playful", "None"]
+    style_options = agent_core.STYLES + ["None"]
+    mood_options = agent_core.MOODS + ["None"]
+    purpose_options = agent_core.PURPOSES + ["None"]
+    tone_options = agent_core.TONES + ["None"]
 
     # Get the index of the default option or set it to 0 if not found
     style = st.selectbox("Style:", style_options, key="select_style",
-                        index=style_options.index(default_style) if default_style in style_options else 0)
+                        index=style_options.index(style) if style in style_options else 0)
     mood = st.selectbox("Mood:", mood_options, key="select_mood",
-                        index=mood_options.index(default_mood) if default_mood in mood_options else 0)
+                        index=mood_options.index(mood) if mood in mood_options else 0)
     purpose = st.selectbox("Purpose:", purpose_options, key="select_purpose", 
-                        index=purpose_options.index(default_purpose) if default_purpose in purpose_options else 0)
+                        index=purpose_options.index(purpose) if purpose in purpose_options else 0)
     tone = st.selectbox("Tone:", tone_options, key="select_tone",
-                        index=tone_options.index(default_tone) if default_tone in tone_options else 0)
+                        index=tone_options.index(tone) if tone in tone_options else 0)
     
-    if st.button("Generate Poem", key="generate_button"):
-        prompt_details = f"Create a {style} poem with a {mood} mood for {purpose} in a {tone} tone:\n{prompt}"
-        response = openai.chat.completions.create(
-            model="gpt-4-turbo",
-            messages=[
-                {"role": "system", "content": "You are a creative poet."},
-                {"role": "user", "content": prompt_details}
-            ]
-        )
-        poem = response.choices[0].message.content.strip()
-        st.session_state.last_poem = poem
-        st.session_state.conversation_log.append({"role": "assistant", "content": poem})
+    if st.button("Generate Poem", key="generate_button", disabled=not prompt):
+        cancel_job("generate_poem")
+        start_job("generate_poem", agent_core.generate_poem, prompt, style, mood, purpose, tone)
+    elif routed_complete and not st.session_state.poem_started:
+        start_job("generate_poem", agent_core.generate_poem, prompt, style, mood, purpose, tone)
+    st.session_state.poem_started = st.session_state.poem_started or routed_complete
 
 # Function to trim the poem
 def trim_poem():
-    if st.session_state.last_poem:
-        poem = st.session_state.last_poem
-        lines = poem.strip().split('\n')
-        trimmed_poem = [
-            lines[i] + " " + lines[i + 1] if i + 1 < len(lines) else lines[i]
-            for i in range(0, len(lines), 2)
-        ]
-        trimmed_poem = '\n'.join(trimmed_poem)
-        st.session_state.last_poem = trimmed_poem
-        st.session_state.conversation_log.append({"role": "assistant", "content": trimmed_poem})
+    history = st.session_state.poem_history
+    if history.current is not None:
+        version = history.apply("trimmed")
+        st.session_state.conversation_log.append({"role": "assistant", "version": version})
     else:
         st.session_state.conversation_log.append({"role": "assistant", "content": "No poem available to trim."})
 
 # Function to recapitalize text
 def recapitalize():
-    if st.session_state.last_poem:
-        recapitalized_text = st.session_state.last_poem.upper()
-        st.session_state.last_poem = recapitalized_text
-        st.session_state.conversation_log.append({"role": "assistant", "content": recapitalized_text})
+    history = st.session_state.poem_history
+    if history.current is not None:
+        version = history.apply("capitalized")
+        st.session_state.conversation_log.append({"role": "assistant", "version": version})
     else:
         st.session_state.conversation_log.append({"role": "assistant", "content": "No poem text to recapitalize!"})
 
 # Function to decapitalize text
 def decapitalize():
-    if st.session_state.last_poem:
-        decapitalized_text = st.session_state.last_poem.lower()
-        st.session_state.last_poem = decapitalized_text
-        st.session_state.conversation_log.append({"role": "assistant", "content": decapitalized_text})
+    history = st.session_state.poem_history
+    if history.current is not None:
+        version = history.apply("decapitalized")
+        st.session_state.conversation_log.append({"role": "assistant", "version": version})
     else:
         st.session_state.conversation_log.append({"role": "assistant", "content": "No poem text to decapitalize!"})
 
 # Function to handle queries about the generated poem
 def handle_poem_query(user_query):
-    if st.session_state.last_poem:
-        poem = st.session_state.last_poem
-        prompt = f"Here is a poem:\n\n{poem}\n\nThe user has a question about the poem: {user_query}\n\nAnswer the question in a helpful manner."
-        response = openai.chat.completions.create(
-            model="gpt-4-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful assistant that analyzes poems."},
-                {"role": "user", "content": prompt}
-            ]
-        )
-        answer = response.choices[0].message.content.strip()
-        st.session_state.conversation_log.append({"role": "assistant", "content": answer})
+    history = st.session_state.poem_history
+    if history.current is not None:
+        ask_poem_question(history, user_query)
     else:
         st.session_state.conversation_log.append({"role": "assistant", "content": "No poem available to analyze."})
 
-# Function to determine the action and arguments
+# Function to determine the action and arguments; when several tools are called, the last one wins
 def conversation(user_query):
-    messages = [
-        {"role": "system", "content": "You are a poetic agent who analyzes the user query and then routes their query to available functions to generate the output."},
-        {"role": "user", "content": user_query}
-    ]
-
-    tools = [
-        {
-            "type": "function",
-            "function": {
-                "name": "generate_poem",
-                "description": "Generate a poem with specified details: style, mood, purpose, tone.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "prompt": {"type": "string"},
-                        "default_style": {"type": "string"},
-                        "default_mood": {"type": "string"},
-                        "default_purpose": {"type": "string"},
-                        "default_tone": {"type": "string"}
-                    },
-                    "required": ["prompt"]
-                }
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "trim_poem",
-                "description": "Trim a poem by merging alternate lines.",
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "recapitalize",
-                "description": "Capitalize the text as required and turn it into uppercase.",
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "decapitalize",
-                "description": "Decapitalize the text as required and turn it into lowercase.",
-            }
-        },
-        {
-            "type": "function",
-            "function": {
-                "name": "handle_poem_query",
-                "description": "Handles user queries about the generated poem.",
-                "parameters": {
-                    "type": "object",
-                    "properties": {
-                        "user_query": {"type": "string"}
-                    },
-                    "required": ["user_query"]
-                }
-            }
-        }
-    ]
-
-    response = client.chat.completions.create(
-        model="gpt-4-turbo",
-        messages=messages,
-        tools=tools,
-        tool_choice="required"
-    )
-    response_message = response.choices[0].message
-    tool_calls = response_message.tool_calls
-    
     available_functions = {
         "generate_poem": generate_poem,
         "trim_poem": trim_poem,
@@ -174,38 +80,89 @@ def conversation(user_query):
         "decapitalize": decapitalize,
         "handle_poem_query": handle_poem_query
     }
+    tool_calls = agent_core.route(user_query, tool_choice="required")
+    if not tool_calls:
+        return None, {}
+    function_name, function_args = tool_calls[-1]
+    return available_functions[function_name], function_args
 
-    if tool_calls:
-        for tool_call in tool_calls:
-            function_name = tool_call.function.name
-            function_to_call = available_functions[function_name]
-            function_args = json.loads(tool_call.function.arguments)
-    
-    return function_to_call, function_args
+# Session state written to disk, so a restart or reconnect does not lose the conversation
+SESSION_KEYS = ["poem_history", "poem_context", "conversation_log", "pending_poem_args", "poem_started"]
 
 # Streamlit app
 def main():
     st.title("Poetic AI Agent")
+    restore_session(agent_core.SESSION_DECODERS)
+    render_sidebar()
 
     # Initializing session state variables
-    if 'last_poem' not in st.session_state:
-        st.session_state.last_poem = ""
+    if 'poem_history' not in st.session_state:
+        st.session_state.poem_history = agent_core.new_poem_history()
+    if 'poem_context' not in st.session_state:
+        st.session_state.poem_context = agent_core.new_poem_context()
     if 'conversation_log' not in st.session_state:
         st.session_state.conversation_log = []
+    if 'last_query' not in st.session_state:
+        st.session_state.last_query = ""
+    if 'pending_poem_args' not in st.session_state:
+        st.session_state.pending_poem_args = None
+    if 'poem_started' not in st.session_state:
+        st.session_state.poem_started = False
 
     user_query = st.text_input("Enter your query:")
 
-    if user_query:
+    # Route a new query in the background; reruns reuse the in-flight or finished routing
+    if user_query and user_query != st.session_state.last_query:
+        st.session_state.last_query = user_query
+        st.session_state.pending_poem_args = None
+        st.session_state.poem_started = False
         st.session_state.conversation_log.append({"role": "user", "content": user_query})
-        function_to_call, function_args = conversation(user_query)
-        
-        
-        if function_to_call:
-            '''print(function_to_call)
-            print(function_args)'''
-            function_to_call(**function_args)
+        cancel_session_jobs(keep=open_poem_questions())
+        start_job("conversation", conversation, user_query)
+
+    job = finished_job("conversation", "your query")
+    if job:
+        if job.error:
+            st.session_state.conversation_log.append({"role": "assistant", "content": f"Could not process your query: {job.error}"})
+        else:
+            function_to_call, function_args = job.result
+            st.session_state.pending_poem_args = None
+            if function_to_call is generate_poem:
+                # The poem options stay on screen across reruns until the next query
+                st.session_state.pending_poem_args = function_args
+            elif function_to_call:
+                function_to_call(**function_args)
+            else:
+                st.session_state.conversation_log.append({"role": "assistant", "content": "No function matched your query."})
+
+    # While the routing reply streams in, show the poem options filled in so far
+    routing = job_progress("conversation")
+    if routing.get("tool") == "generate_poem":
+        st.session_state.pending_poem_args = routing["arguments"]
+
+    if st.session_state.pending_poem_args is not None:
+        generate_poem(**st.session_state.pending_poem_args)
+
+    job = finished_job("generate_poem", "your poem")
+    if job:
+        if job.error:
+            st.session_state.conversation_log.append({"role": "assistant", "content": f"Could not generate the poem: {job.error}"})
+        else:
+            poem, source = job.result
+            version = st.session_state.poem_history.add(poem)
+            st.session_state.conversation_log.append({"role": "assistant", "version": version})
+            if source != agent_core.GPT_SOURCE:
+                # Only degraded-mode poems are captioned in this app
+                st.session_state.conversation_log.append({"role": "assistant", "content": source})
+
+    for job in finished_poem_questions():
+        if job.error:
+            st.session_state.conversation_log.append({"role": "assistant", "content": f"Could not answer the query: {job.error}"})
         else:
-            st.session_state.conversation_log.append({"role": "assistant", "content": "No function matched your query."})
+            st.session_state.conversation_log.append({"role": "assistant", "content": job.result})
+            st.caption(describe_report(st.session_state.poem_context.last_report))
+
+    render_poem_history(st.session_state.poem_history)
 
     # Display the conversation log
     st.header("Conversation Log")
@@ -214,7 +171,11 @@ def main():
         if message['role'] == "user":
             st.text_area(f"You:", message['content'], key=key)
         elif message['role'] == "assistant":
-            st.text_area(f"Assistant:", message['content'], key=key)
+            # Poem versions are stored by reference and only rebuilt when shown
+            content = message['content'] if 'content' in message else st.session_state.poem_history.text(message['version'])
+            st.text_area(f"Assistant:", content, key=key)
+
+    save_session(SESSION_KEYS)
 
 if __name__ == "__main__":
     main()
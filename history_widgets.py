@@ -0,0 +1,26 @@
+import streamlit as st
+
+
+# Function to show the session's poem with undo/redo and a choice of which version to edit next
+def render_poem_history(history):
+    if not len(history):
+        return
+    st.header("Poem History")
+    undo_column, redo_column = st.columns(2)
+    if undo_column.button("Undo", key="poem_undo", disabled=not history.can_undo()):
+        history.undo()
+    if redo_column.button("Redo", key="poem_redo", disabled=not history.can_redo()):
+        history.redo()
+
+    # Picking an earlier version makes the next trim/capitalize branch from it
+    chosen = st.selectbox(
+        "Next edit applies to:",
+        range(len(history)),
+        index=history.current,
+        format_func=history.describe,
+    )
+    if chosen != history.current:
+        history.checkout(chosen)
+
+    st.caption(history.describe(history.current))
+    st.text(history.text())
@@ -0,0 +1,65 @@
+import uuid
+import streamlit as st
+from context_window import describe_report
+from job_widgets import start_job, finished_job
+from agent_core import answer_general_query
+from question_widgets import ask_poem_question, finished_poem_questions
+
+# Intents that edit the current poem: the history operation each one applies and what the agent says
+EDIT_INTENTS = {
+    "trim a poem": ("trimmed", "Trimming the poem as requested..."),
+    "capitalize text": ("capitalized", "Capitalizing the text as requested..."),
+    "decapitalize text": ("decapitalized", "Decapitalizing the text as requested..."),
+}
+
+
+# Function to add one of the agent's replies to the conversation log: a poem version or some text
+def log_reply(**reply):
+    st.session_state.conversation_log.append({"id": str(uuid.uuid4()), "role": "system", **reply})
+
+
+def _pending(intent):
+    return intent in st.session_state.intents and intent not in st.session_state.actions_done
+
+
+# Function to carry out the edit, poem query and general query intents of the last message.
+# on_error(error, action) shows why a job failed, e.g. on_error(error, "answer the query")
+def render_intents(history, user_query, on_error):
+    for intent, (operation, message) in EDIT_INTENTS.items():
+        if _pending(intent) and history.current is not None:
+            st.write(f"Sublime Agent: {message}")
+            version = history.apply(operation)
+            st.session_state.actions_done.append(intent)
+            log_reply(version=version)
+            st.write("Sublime Agent:")
+            st.write(history.text(version))
+
+    if _pending("poem query") and history.current is not None:
+        st.write("Sublime Agent: Answering your poem query...")
+        ask_poem_question(history, user_query)
+        st.session_state.actions_done.append("poem query")
+
+    if _pending("general query"):
+        st.write("Sublime Agent: Routing your query to GPT...")
+        start_job("general query", answer_general_query, user_query)
+        job = finished_job("general query", "your query")
+        if job and job.error:
+            on_error(job.error, "answer the query")
+        elif job:
+            st.session_state.actions_done.append("general query")
+            log_reply(content=job.result)
+            st.write("Sublime Agent:")
+            st.write(job.result)
+
+
+# Function to log the answers to the session's poem queries as they arrive; a query stays open
+# after the next message is sent, so its answer may come in while a later message is handled
+def render_poem_answers(on_error):
+    for job in finished_poem_questions():
+        if job.error:
+            on_error(job.error, "answer the poem query")
+            continue
+        log_reply(content=job.result)
+        st.write("Sublime Agent:")
+        st.write(job.result)
+        st.caption(describe_report(st.session_state.poem_context.last_report))
@@ -0,0 +1,88 @@
+import uuid
+import streamlit as st
+import jobs
+
+# How often the progress fragment polls a running job, in seconds
+POLL_INTERVAL = 0.5
+
+
+# Function to get (or create) the id that ties background jobs to this browser session
+def get_session_id():
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = str(uuid.uuid4())
+    return st.session_state.session_id
+
+
+def _active_jobs():
+    if "active_jobs" not in st.session_state:
+        st.session_state.active_jobs = {}
+    return st.session_state.active_jobs
+
+
+# Function to run fn in the worker pool; a rerun will not start the same job twice
+def start_job(name, fn, *args, **kwargs):
+    job_id = _active_jobs().get(name)
+    job = jobs.get_job(job_id) if job_id else None
+    if job is not None:
+        # Still running, or finished but not yet collected by finished_job
+        return job
+    job = jobs.submit_job(get_session_id(), name, fn, *args, **kwargs)
+    _active_jobs()[name] = job.id
+    return job
+
+
+# Function to cancel everything the session still has in flight, e.g. when a new query is sent,
+# except the jobs named in keep
+def cancel_session_jobs(keep=()):
+    jobs.cancel_session_jobs(get_session_id(), keep)
+    active = _active_jobs()
+    for name in [name for name in active if name not in keep]:
+        del active[name]
+
+
+# Function to tell whether a job was started and its result has not been collected yet
+def is_active(name):
+    return name in _active_jobs()
+
+
+# Function to cancel one of the session's jobs, e.g. before restarting it with other arguments
+def cancel_job(name):
+    job_id = _active_jobs().pop(name, None)
+    job = jobs.get_job(job_id) if job_id else None
+    if job is not None:
+        job.cancel()
+
+
+# Function to read what a running job has reported so far; empty once it is collected
+def job_progress(name):
+    job_id = _active_jobs().get(name)
+    job = jobs.get_job(job_id) if job_id else None
+    return job.progress if job is not None else {}
+
+
+# Function to collect a finished job; while it runs, shows a live progress line instead
+def finished_job(name, label=None):
+    active = _active_jobs()
+    job_id = active.get(name)
+    if job_id is None:
+        return None
+    job = jobs.get_job(job_id)
+    if job is None:
+        # The process restarted or the job expired before we collected it
+        del active[name]
+        return None
+    if job.done():
+        del active[name]
+        jobs.forget_job(job_id)
+        return job
+    _job_progress(job_id, label or name.replace("_", " "), job.progress_version)
+    return None
+
+
+@st.experimental_fragment(run_every=POLL_INTERVAL)
+def _job_progress(job_id, label, seen_version):
+    job = jobs.get_job(job_id)
+    if job is None or job.done() or job.progress_version != seen_version:
+        # Rerun the whole script so the result, or the progress so far, is shown
+        st.rerun()
+    st.info(f"Sublime Agent is working on {label}... ({job.elapsed():.1f}s)")
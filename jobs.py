@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# Number of worker threads shared by every session served from this process
+MAX_WORKERS = int(os.getenv("SUBLIME_MAX_WORKERS", "8"))
+
+# Finished jobs are forgotten after this many seconds if nobody collects them
+JOB_TTL_SECONDS = int(os.getenv("SUBLIME_JOB_TTL", "900"))
+
+_executor = None
+_executor_lock = threading.Lock()
+_jobs = {}
+_jobs_lock = threading.Lock()
+_local = threading.local()
+
+
+# A single unit of background work owned by one session
+class Job:
+    def __init__(self, session_id, name, fn, args, kwargs):
+        self.id = str(uuid.uuid4())
+        self.session_id = session_id
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = "pending"
+        self.result = None
+        self.error = None
+        self.submitted_at = time.monotonic()
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.progress = {}
+        self.progress_version = 0
+        # Guards status changes, so a job is never reported cancelled while its function still runs
+        self._lock = threading.Lock()
+
+    def done(self):
+        return self.status in ("done", "failed", "cancelled")
+
+    def elapsed(self):
+        end = self.finished_at if self.finished_at is not None else time.monotonic()
+        return end - self.submitted_at
+
+    # Function to cancel the job: a pending job is finished right away, a running one is asked to
+    # stop through cancel_event and finishes as cancelled once its function returns
+    def cancel(self):
+        with self._lock:
+            self.cancel_event.set()
+            if self.status == "pending":
+                self._finish("cancelled")
+
+    def _finish(self, status, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.finished_at = time.monotonic()
+        self.status = status
+
+    def _run(self):
+        with self._lock:
+            if self.status != "pending":
+                return
+            self.status = "running"
+        _local.job = self
+        try:
+            result = self.fn(*self.args, **self.kwargs)
+        except Exception as e:
+            with self._lock:
+                self._finish("cancelled" if self.cancel_event.is_set() else "failed", error=e)
+        else:
+            with self._lock:
+                if self.cancel_event.is_set():
+                    self._finish("cancelled")
+                else:
+                    self._finish("done", result=result)
+        finally:
+            _local.job = None
+
+
+# Function to get the job running on the current worker thread, if any
+def current_job():
+    return getattr(_local, "job", None)
+
+
+# Function to publish partial results of the current job, e.g. fields parsed from a streamed reply
+def report_progress(**fields):
+    job = current_job()
+    if job is not None:
+        job.progress = dict(job.progress, **fields)
+        job.progress_version += 1
+
+
+# Function to lazily create the process-wide worker pool
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="sublime-job")
+        return _executor
+
+
+# Function to submit a job, reusing an unfinished job with the same session and name
+def submit_job(session_id, name, fn, *args, **kwargs):
+    with _jobs_lock:
+        _prune_locked()
+        for job in _jobs.values():
+            if (job.session_id == session_id and job.name == name
+                    and not job.done() and not job.cancel_event.is_set()):
+                return job
+        job = Job(session_id, name, fn, args, kwargs)
+        _jobs[job.id] = job
+    get_executor().submit(job._run)
+    return job
+
+
+# Function to look up a job by id; returns None if it is unknown or expired
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+# Function to remove a job from the registry once its result has been collected
+def forget_job(job_id):
+    with _jobs_lock:
+        _jobs.pop(job_id, None)
+
+
+# Function to list every job belonging to a session
+def session_jobs(session_id):
+    with _jobs_lock:
+        return [job for job in _jobs.values() if job.session_id == session_id]
+
+
+# Function to cancel every unfinished job of a session, except the jobs named in keep
+def cancel_session_jobs(session_id, keep=()):
+    cancelled = 0
+    for job in session_jobs(session_id):
+        if not job.done() and job.name not in keep:
+            job.cancel()
+            cancelled += 1
+    return cancelled
+
+
+def _prune_locked():
+    now = time.monotonic()
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job.done() and now - job.finished_at > JOB_TTL_SECONDS
+    ]
+    for job_id in expired:
+        del _jobs[job_id]
@@ -0,0 +1,316 @@
+import asyncio
+import os
+import queue
+import random
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import openai
+import jobs
+import metrics
+from circuit_breaker import CircuitOpen, get_breaker
+from usage_ledger import estimate_tokens, get_ledger
+
+# Default model used by every app
+MODEL = "gpt-4-turbo"
+
+# Seconds an operation may take in total, hedges included
+DEFAULT_DEADLINE = float(os.getenv("SUBLIME_DEADLINE", "60"))
+
+# A duplicate request is sent once the primary is slower than this percentile of recent calls
+HEDGE_PERCENTILE = float(os.getenv("SUBLIME_HEDGE_PERCENTILE", "95"))
+
+# Hedge delay used until an operation has enough latency samples for a percentile
+DEFAULT_HEDGE_DELAY = float(os.getenv("SUBLIME_HEDGE_DELAY", "10"))
+MIN_HEDGE_SAMPLES = 20
+
+# Share of hedge-won calls whose primary is left running, only to measure unhedged latency
+SHADOW_RATE = float(os.getenv("SUBLIME_HEDGE_SHADOW_RATE", "0.1"))
+
+# How often a waiting caller checks whether its job has been cancelled
+CANCEL_POLL_INTERVAL = 0.2
+
+# Marks the end of a streamed reply on the queue between the event loop and the caller
+_END_OF_STREAM = object()
+
+_loop = None
+_loop_lock = threading.Lock()
+_client = None
+
+
+# Raised when an operation does not finish within its deadline
+class DeadlineExceeded(Exception):
+    pass
+
+
+# Raised when the session that started the request cancelled it, e.g. by sending a new query
+class RequestCancelled(Exception):
+    pass
+
+
+# Function to start (once per process) the event loop that runs all upstream requests
+def _get_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="sublime-llm", daemon=True).start()
+        return _loop
+
+
+# The async client lives on the shared loop so a losing request can really be aborted
+def _get_client():
+    global _client
+    if _client is None:
+        _client = openai.AsyncOpenAI(api_key=openai.api_key or None)
+    return _client
+
+
+# Function to pick how long to wait for the primary request before hedging. It reads the primaries'
+# own latency: the winners' latency drops as hedging works, which would keep pulling the delay down
+def hedge_delay(operation):
+    series = f"llm.{operation}.primary_latency"
+    if metrics.sample_count(series) < MIN_HEDGE_SAMPLES:
+        return DEFAULT_HEDGE_DELAY
+    return metrics.percentile(series, HEDGE_PERCENTILE)
+
+
+# Function to get the circuit breaker shared by every call to this model's endpoint
+def breaker_for(model=MODEL):
+    return get_breaker(f"{model}/chat.completions")
+
+
+# Function to wait until the session's and the process's usage budgets admit a request;
+# raises BudgetExceeded when they will not in time
+def _admit(operation, messages, job, max_tokens):
+    session_id = job.session_id if job is not None else None
+    cancel_event = job.cancel_event if job is not None else None
+    reservation = get_ledger().admit(session_id, operation, estimate_tokens(operation, messages, max_tokens), cancel_event)
+    if reservation is None:
+        metrics.incr(f"llm.{operation}.cancelled")
+        raise RequestCancelled(f"{operation} was cancelled")
+    return reservation
+
+
+# Function to ask the breaker for permission; a refused request gives its budget back
+def _before_call(breaker, reservation):
+    try:
+        breaker.before_call()
+    except CircuitOpen:
+        get_ledger().release(reservation)
+        raise
+
+
+# Function to call the chat completions API with a deadline, hedging and cancellation
+def chat(operation, messages, model=MODEL, deadline=None, **kwargs):
+    deadline = DEFAULT_DEADLINE if deadline is None else deadline
+    request = dict(model=model, messages=messages, **kwargs)
+    job = jobs.current_job()
+    breaker = breaker_for(model)
+    metrics.incr(f"llm.{operation}.calls")
+    reservation = _admit(operation, messages, job, kwargs.get("max_tokens"))
+    # Fails fast with CircuitOpen while the upstream is known to be unhealthy
+    _before_call(breaker, reservation)
+    future = asyncio.run_coroutine_threadsafe(
+        _hedged_call(operation, request, deadline, hedge_delay(operation), breaker, reservation), _get_loop()
+    )
+    while True:
+        try:
+            return future.result(timeout=CANCEL_POLL_INTERVAL)
+        except FutureTimeoutError:
+            if job is not None and job.cancel_event.is_set():
+                # Cancelling the future cancels the coroutine, which aborts its HTTP requests
+                future.cancel()
+                metrics.incr(f"llm.{operation}.cancelled")
+                raise RequestCancelled(f"{operation} was cancelled")
+
+
+# Function to stream a chat completion chunk by chunk, with the same deadline, breaker and
+# cancellation as chat(); streams are not hedged, since a duplicate would repeat the output
+def stream_chat(operation, messages, model=MODEL, deadline=None, **kwargs):
+    deadline = DEFAULT_DEADLINE if deadline is None else deadline
+    # The last chunk then carries the token usage of the whole reply
+    request = dict(model=model, messages=messages, stream=True, stream_options={"include_usage": True}, **kwargs)
+    job = jobs.current_job()
+    breaker = breaker_for(model)
+    metrics.incr(f"llm.{operation}.calls")
+    reservation = _admit(operation, messages, job, kwargs.get("max_tokens"))
+    _before_call(breaker, reservation)
+    chunks = queue.Queue()
+    future = asyncio.run_coroutine_threadsafe(_stream(operation, request, deadline, breaker, chunks), _get_loop())
+    try:
+        while True:
+            try:
+                chunk = chunks.get(timeout=CANCEL_POLL_INTERVAL)
+            except queue.Empty:
+                if job is not None and job.cancel_event.is_set():
+                    metrics.incr(f"llm.{operation}.cancelled")
+                    raise RequestCancelled(f"{operation} was cancelled")
+                continue
+            if chunk is _END_OF_STREAM:
+                # Raises whatever ended the stream early
+                future.result()
+                return
+            if chunk.usage is not None:
+                get_ledger().settle(reservation, chunk.usage)
+            yield chunk
+    finally:
+        # Also stops the upstream stream when the caller stops reading before the end
+        future.cancel()
+
+
+async def _stream(operation, request, deadline, breaker, chunks):
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        await asyncio.wait_for(_read_stream(operation, request, deadline, chunks, started), timeout=deadline)
+    except asyncio.TimeoutError:
+        breaker.after_call(False, loop.time() - started)
+        metrics.incr(f"llm.{operation}.deadline_exceeded")
+        raise DeadlineExceeded(f"{operation} did not finish within {deadline:g}s")
+    except asyncio.CancelledError:
+        breaker.release()
+        raise
+    except Exception as e:
+        breaker.after_call(not _is_upstream_failure(e), loop.time() - started)
+        raise
+    else:
+        breaker.after_call(True, loop.time() - started)
+        metrics.observe(f"llm.{operation}.latency", loop.time() - started)
+    finally:
+        chunks.put(_END_OF_STREAM)
+
+
+async def _read_stream(operation, request, deadline, chunks, started):
+    loop = asyncio.get_running_loop()
+    stream = await _get_client().chat.completions.create(timeout=deadline, **request)
+    first = True
+    async for chunk in stream:
+        if first:
+            metrics.observe(f"llm.{operation}.first_chunk", loop.time() - started)
+            first = False
+        chunks.put(chunk)
+
+
+# Runs one operation: the primary request, plus a hedged duplicate if the primary is slow. The
+# breaker gets one verdict per operation, however many attempts it took, so hedging does not
+# double-count a failing upstream
+async def _hedged_call(operation, request, deadline, delay, breaker, reservation):
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    weight = {"primary": 1}
+    primary = asyncio.ensure_future(_attempt(operation, request, start + deadline, reservation, weight))
+    hedge = None
+    hedge_decided = False
+    shadow = False
+    pending = {primary}
+    last_error = None
+    try:
+        while True:
+            elapsed = loop.time() - start
+            if elapsed >= deadline:
+                # Cut off by the deadline: that is a slow call as far as the breaker is concerned
+                breaker.after_call(False, elapsed)
+                metrics.incr(f"llm.{operation}.deadline_exceeded")
+                raise DeadlineExceeded(f"{operation} did not finish within {deadline:g}s")
+            timeout = deadline - elapsed
+            if not hedge_decided:
+                timeout = min(timeout, max(delay - elapsed, 0))
+            done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    breaker.after_call(True, loop.time() - start)
+                    metrics.observe(f"llm.{operation}.latency", loop.time() - start)
+                    if task is hedge:
+                        metrics.incr(f"llm.{operation}.hedge_wins")
+                        if random.random() < SHADOW_RATE:
+                            # Weight the shadow sample so the primary series stays unbiased
+                            shadow = True
+                            weight["primary"] = round(1 / SHADOW_RATE)
+                            primary.add_done_callback(_discard_result)
+                    return task.result()
+                last_error = task.exception()
+            if not hedge_decided and pending and loop.time() - start >= delay:
+                hedge_decided = True
+                hedge = _send_hedge(operation, request, start + deadline, breaker, reservation)
+                if hedge is not None:
+                    pending.add(hedge)
+            if not pending:
+                breaker.after_call(not _is_upstream_failure(last_error), loop.time() - start)
+                raise last_error
+    except asyncio.CancelledError:
+        # Cancelled by the session: no verdict, but the probe slot is given back
+        breaker.release()
+        raise
+    finally:
+        # The first response wins; whatever is still in flight is cancelled
+        for task in (primary, hedge):
+            if task is not None and not task.done() and not (shadow and task is primary):
+                task.cancel()
+        if hedge is not None:
+            # The hedge's own permission from the breaker, which needs no verdict of its own
+            breaker.release()
+
+
+# Function to send a hedged duplicate if the usage budgets have room for it right now and the
+# breaker allows it; a hedge is optional, so it never waits for admission
+def _send_hedge(operation, request, expires_at, breaker, reservation):
+    ledger = get_ledger()
+    hedge_reservation = ledger.try_admit(reservation.session_id, operation, reservation.tokens)
+    if hedge_reservation is None:
+        metrics.incr(f"llm.{operation}.hedges_skipped")
+        return None
+    if not _breaker_allows(breaker):
+        ledger.release(hedge_reservation)
+        return None
+    metrics.incr(f"llm.{operation}.hedges")
+    return asyncio.ensure_future(_attempt(operation, request, expires_at, hedge_reservation, None))
+
+
+def _breaker_allows(breaker):
+    try:
+        breaker.before_call()
+    except CircuitOpen:
+        return False
+    return True
+
+
+# Client errors say nothing about the upstream's health, so they do not count against the breaker
+def _is_upstream_failure(error):
+    status = getattr(error, "status_code", None)
+    return status is None or status >= 500 or status == 429
+
+
+# One upstream request; every request that completes settles its own reservation, including a
+# shadow primary that finishes after the hedge won, and primaries record how long an unhedged
+# call would take
+async def _attempt(operation, request, expires_at, reservation, weight):
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    response = await _get_client().chat.completions.create(timeout=max(expires_at - started, 0.1), **request)
+    if response.usage is not None:
+        get_ledger().settle(reservation, response.usage)
+    if weight is not None:
+        for _ in range(weight["primary"]):
+            metrics.observe(f"llm.{operation}.primary_latency", loop.time() - started)
+    return response
+
+
+def _discard_result(task):
+    if not task.cancelled():
+        task.exception()
+
+
+# Function to summarise hedging for one operation: hedge rate and p99 with vs. without hedging
+def hedge_stats(operation):
+    calls = metrics.counter(f"llm.{operation}.calls")
+    hedges = metrics.counter(f"llm.{operation}.hedges")
+    p99 = metrics.percentile(f"llm.{operation}.latency", 99)
+    primary_p99 = metrics.percentile(f"llm.{operation}.primary_latency", 99)
+    return {
+        "calls": calls,
+        "hedge_rate": hedges / calls if calls else 0.0,
+        "hedge_wins": metrics.counter(f"llm.{operation}.hedge_wins"),
+        "p99": p99,
+        "primary_p99": primary_p99,
+        "p99_improvement": primary_p99 - p99 if p99 is not None and primary_p99 is not None else None,
+    }
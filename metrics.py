@@ -0,0 +1,56 @@
+import math
+import threading
+from collections import defaultdict, deque
+
+# Number of most recent samples kept per latency series
+SAMPLE_WINDOW = 1000
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_samples = defaultdict(lambda: deque(maxlen=SAMPLE_WINDOW))
+
+
+# Function to add to a named counter
+def incr(name, amount=1):
+    with _lock:
+        _counters[name] += amount
+
+
+# Function to read a named counter
+def counter(name):
+    with _lock:
+        return _counters.get(name, 0)
+
+
+# Function to record one sample (e.g. a latency in seconds) in a named series
+def observe(name, value):
+    with _lock:
+        _samples[name].append(value)
+
+
+# Function to count the samples currently kept for a series
+def sample_count(name):
+    with _lock:
+        return len(_samples.get(name, ()))
+
+
+# Function to compute a nearest-rank percentile of a series; None if it has no samples
+def percentile(name, pct):
+    with _lock:
+        values = sorted(_samples.get(name, ()))
+    if not values:
+        return None
+    rank = max(math.ceil(pct / 100 * len(values)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+# Function to dump every counter and the p50/p99 of every series, for display
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        names = list(_samples)
+    series = {
+        name: {"count": sample_count(name), "p50": percentile(name, 50), "p99": percentile(name, 99)}
+        for name in names
+    }
+    return {"counters": counters, "series": series}
@@ -0,0 +1,67 @@
+import json
+
+_decoder = json.JSONDecoder()
+_WHITESPACE = " \t\n\r"
+
+
+def _skip_whitespace(text, pos):
+    while pos < len(text) and text[pos] in _WHITESPACE:
+        pos += 1
+    return pos
+
+
+# Incremental parser for a JSON object that arrives in pieces, e.g. streamed tool-call arguments.
+# Top-level fields are reported once their value has arrived in full; nothing is parsed twice
+# except the value that is still being written
+class PartialObject:
+    def __init__(self):
+        self.text = ""
+        self.fields = {}
+        self.complete = False
+        self._pos = 0
+
+    # Function to add the next piece of text; returns the fields it completed
+    def feed(self, chunk):
+        self.text += chunk
+        completed = {}
+        while not self.complete:
+            field = self._next_field()
+            if field is None:
+                break
+            key, value = field
+            self.fields[key] = value
+            completed[key] = value
+        return completed
+
+    # Function to get the whole object once the text is complete, parsed strictly
+    def result(self):
+        return json.loads(self.text) if self.text.strip() else {}
+
+    def _next_field(self):
+        text = self.text
+        pos = _skip_whitespace(text, self._pos)
+        if pos >= len(text):
+            return None
+        if text[pos] in "{,":
+            pos = _skip_whitespace(text, pos + 1)
+        if pos < len(text) and text[pos] == "}":
+            self.complete = True
+            return None
+        try:
+            key, pos = _decoder.raw_decode(text, pos)
+            pos = _skip_whitespace(text, pos)
+            if pos >= len(text) or text[pos] != ":":
+                return None
+            pos = _skip_whitespace(text, pos + 1)
+            if pos >= len(text):
+                return None
+            value, end = _decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            return None
+        if text[pos] not in '"{[':
+            # A number or literal is only complete once something follows it, e.g. "12" of "125"
+            after = _skip_whitespace(text, end)
+            if after >= len(text) or text[after] not in ",}":
+                return None
+        self._pos = end
+        return key, value
@@ -0,0 +1,126 @@
+from collections import OrderedDict
+
+# Number of materialized versions kept per session; everything else is recomputed on demand
+CACHE_SIZE = 8
+
+
+# Version tree of one session's poem: generated poems are stored once as base versions and every
+# edit is stored as an operation name on top of its parent, so versions share their common history
+class PoemHistory:
+    def __init__(self, operations, cache_size=CACHE_SIZE):
+        self.operations = operations
+        self.current = None
+        self._nodes = []
+        self._undo = []
+        self._redo = []
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+
+    def __len__(self):
+        return len(self._nodes)
+
+    # Function to export the version tree for a session snapshot; cached texts are not included
+    def to_dict(self):
+        return {
+            "nodes": [list(node) for node in self._nodes],
+            "current": self.current,
+            "undo": list(self._undo),
+            "redo": list(self._redo),
+        }
+
+    # Function to rebuild a history from to_dict() output; operations are not stored, so pass them again
+    @classmethod
+    def from_dict(cls, data, operations, cache_size=CACHE_SIZE):
+        history = cls(operations, cache_size)
+        history._nodes = [tuple(node) for node in data["nodes"]]
+        history.current = data["current"]
+        history._undo = list(data["undo"])
+        history._redo = list(data["redo"])
+        return history
+
+    # Function to store a newly generated poem as a new base version and make it current
+    def add(self, text, label="original"):
+        self._nodes.append((None, label, text))
+        return self._move_to(len(self._nodes) - 1)
+
+    # Function to record an edit of the current version (or of any earlier version, to branch)
+    def apply(self, operation, version=None):
+        parent = self.current if version is None else version
+        if parent is None:
+            raise ValueError("There is no poem to edit yet.")
+        if operation not in self.operations:
+            raise ValueError(f"Unknown poem operation: {operation}")
+        self._nodes.append((parent, operation, None))
+        return self._move_to(len(self._nodes) - 1)
+
+    # Function to make an earlier version current, so the next edit branches from it
+    def checkout(self, version):
+        if not 0 <= version < len(self._nodes):
+            raise ValueError(f"Unknown poem version: {version}")
+        return self._move_to(version)
+
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    def undo(self):
+        if self._undo:
+            self._redo.append(self.current)
+            self.current = self._undo.pop()
+        return self.current
+
+    def redo(self):
+        if self._redo:
+            self._undo.append(self.current)
+            self.current = self._redo.pop()
+        return self.current
+
+    # Function to get the text of a version, building it from its nearest known ancestor
+    def text(self, version=None):
+        version = self.current if version is None else version
+        if version is None:
+            return None
+        chain = []
+        node = version
+        while node not in self._cache and self._nodes[node][2] is None:
+            chain.append(node)
+            node = self._nodes[node][0]
+        text = self._cache[node] if node in self._cache else self._nodes[node][2]
+        for node in reversed(chain):
+            text = self.operations[self._nodes[node][1]](text)
+        self._remember(version, text)
+        return text
+
+    # Function to get the operation that produced a version, e.g. "original" or "trimmed"
+    def label(self, version=None):
+        version = self.current if version is None else version
+        return None if version is None else self._nodes[version][1]
+
+    # Function to get the generated poem a version was edited from (the version itself if it is one)
+    def base(self, version=None):
+        version = self.current if version is None else version
+        while version is not None and self._nodes[version][0] is not None:
+            version = self._nodes[version][0]
+        return version
+
+    # Function to describe a version for menus, e.g. "v3: trimmed from v1"
+    def describe(self, version):
+        parent, label, _ = self._nodes[version]
+        if parent is None:
+            return f"v{version + 1}: {label}"
+        return f"v{version + 1}: {label} from v{parent + 1}"
+
+    def _move_to(self, version):
+        if self.current is not None and self.current != version:
+            self._undo.append(self.current)
+        self._redo.clear()
+        self.current = version
+        return version
+
+    def _remember(self, version, text):
+        self._cache[version] = text
+        self._cache.move_to_end(version)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
@@ -1,20 +1,17 @@
 import streamlit as st
-import openai
-from dotenv import load_dotenv
-import os
 import uuid
-import instructor
+from job_widgets import start_job, cancel_session_jobs, cancel_job, finished_job, job_progress
+from sidebar import render_sidebar
+from history_widgets import render_poem_history
+from intent_widgets import render_intents, render_poem_answers, log_reply
+from question_widgets import open_poem_questions
+from session_widgets import restore_session, save_session
+import agent_core
+from circuit_breaker import CircuitOpen
+from usage_ledger import BudgetExceeded
+from agent_core import determine_intent, generate_poem
 from pydantic import BaseModel, ValidationError, field_validator, Field
-from instructor.exceptions import InstructorRetryException
-from tenacity import Retrying, retry_if_not_exception_type, stop_after_attempt
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Set up OpenAI API key
-openai.api_key = os.getenv("OPENAI_API_KEY")
-
-client = instructor.from_openai(openai.OpenAI(), mode=instructor.Mode.TOOLS)
 
 # Pydantic model for poem validation
 class PoemDetails(BaseModel):
@@ -26,130 +23,107 @@ class PoemDetails(BaseModel):
 
     @field_validator('style')
     def validate_style(cls, v):
-        if v.lower() not in ["classic", "modern", "haiku", "free verse", "sonnet", "limerick"]:
-            raise ValueError('Invalid poem style. Must be one of: classic, modern, haiku, free verse, sonnet, limerick')
+        if v.lower() not in agent_core.STYLES:
+            raise ValueError(f'Invalid poem style. Must be one of: {", ".join(agent_core.STYLES)}')
         return v
 
     @field_validator('mood')
     def validate_mood(cls, v):
-        if v.lower() not in ["happy", "sad", "romantic", "inspirational", "nostalgic"]:
-            raise ValueError('Invalid poem mood. Must be one of: happy, sad, romantic, inspirational, nostalgic')
+        if v.lower() not in agent_core.MOODS:
+            raise ValueError(f'Invalid poem mood. Must be one of: {", ".join(agent_core.MOODS)}')
         return v
 
     @field_validator('purpose')
     def validate_purpose(cls, v):
-        valid_purposes = [
-            "a gift", "personal reflection", "a celebration", "a memorial", "a story",
-            "parents", "siblings", "lovers", "friends", "children",
-            "colleagues", "a special occasion", "a wedding", "an anniversary",
-            "a birthday", "a graduation", "a farewell", "encouragement",
-            "appreciation", "apology", "condolence", "retirement",
-            "a boss", "a team manager", "professional recognition", "a work anniversary", "leisure time"
-        ]
-        if v.lower() not in valid_purposes:
-            raise ValueError(f'Invalid poem purpose. Must be one of: {", ".join(valid_purposes)}')
+        if v.lower() not in agent_core.PURPOSES:
+            raise ValueError(f'Invalid poem purpose. Must be one of: {", ".join(agent_core.PURPOSES)}')
         return v
 
     @field_validator('tone')
     def validate_tone(cls, v):
-        if v.lower() not in ["formal", "informal", "serious", "humorous", "sentimental", "playful"]:
-            raise ValueError('Invalid poem tone. Must be one of: formal, informal, serious, humorous, sentimental, playful')
+        if v.lower() not in agent_core.TONES:
+            raise ValueError(f'Invalid poem tone. Must be one of: {", ".join(agent_core.TONES)}')
         return v
 
+# Function to keep the extracted poem details that pass PoemDetails' validators. Validating the
+# partial details reports every missing or invalid field; the fields it does not name are valid
+def valid_details(details):
+    details = {name: value for name, value in details.items() if name in PoemDetails.model_fields}
+    try:
+        PoemDetails.model_validate(details)
+        invalid = set()
+    except ValidationError as e:
+        invalid = {error["loc"][0] for error in e.errors()}
+    return {name: value if name == "prompt" else value.lower() for name, value in details.items() if name not in invalid}
+
+# Function to extract the poem details from the query; runs in the background worker pool
+def extract_poem_details(user_query):
+    details = agent_core.extract("extract_details", "PoemDetails", PoemDetails.model_json_schema(), user_query)
+    return valid_details(details)
+
+# Function to get the index of an option for a dropdown, or the first option if it is unknown
+def option_index(options, value):
+    return options.index(value) if value in options else 0
+
 # Function to handle server errors
 def handle_server_error(exception):
+    if isinstance(exception, CircuitOpen):
+        st.warning(f"GPT-4 is temporarily unavailable. Please retry in {exception.retry_after:.0f} seconds.")
+        return
+    if isinstance(exception, BudgetExceeded):
+        st.warning(f"You are sending requests faster than we can serve them. Please retry in {exception.retry_after:.0f} seconds.")
+        return
     st.error("There is some problem with the server. Please retry.")
     if st.button("Retry"):
         st.experimental_rerun()
 
-# Function to determine the intents of the user's query
-def determine_intent(user_query):
-    prompt = f"Classify the following user query into one or more of these categories: generate a poem, trim a poem, capitalize text, decapitalize text, poem query, general query.\n\nUser query: {user_query}\n\nCategories (comma-separated if multiple):"
-    for attempt in Retrying(stop=stop_after_attempt(3), retry=retry_if_not_exception_type(InstructorRetryException)):
-        with attempt:
-            response = openai.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that classifies user queries."},
-                    {"role": "user", "content": prompt}
-                ],
-            )
-            intents = response.choices[0].message.content.strip().lower().replace("then", ",").replace("and", ",").split(', ')
-            return intents
-
-# Function to generate a poem from a prompt with specified details
-def generate_poem(prompt, style=None, mood=None, purpose=None, tone=None):
-    prompt_details = f"Create a {style} poem with a {mood} mood for {purpose} in a {tone} tone:\n{prompt}"
-    for attempt in Retrying(stop=stop_after_attempt(3), retry=retry_if_not_exception_type(InstructorRetryException)):
-        with attempt:
-            response = openai.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a creative poet."},
-                    {"role": "user", "content": prompt_details}
-                ],
-            )
-            poem = response.choices[0].message.content.strip()
-            return poem, "This poem is an original creation by GPT-4"
-
-# Function to handle queries about the generated poem
-def handle_poem_query(poem, user_query):
-    prompt = f"Here is a poem:\n\n{poem}\n\nThe user has a question about the poem: {user_query}\n\nAnswer the question in a helpful manner:"
-    for attempt in Retrying(stop=stop_after_attempt(3), retry=retry_if_not_exception_type(InstructorRetryException)):
-        with attempt:
-            response = openai.chat.completions.create(
-                model="gpt-4-turbo",
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that analyzes poems."},
-                    {"role": "user", "content": prompt}
-                ],
-            )
-            answer = response.choices[0].message.content.strip()
-            return answer
-
-# Function to recapitalize text following "capitalize text"
-def recapitalize(text):
-    return text.upper()
-
-# Function to decapitalize text following "decapitalize text"
-def decapitalize(text):
-    return text.lower()
-
-# Function to manually trim the poem by merging alternate lines
-def trim_poem(poem):
-    lines = poem.strip().split('\n')
-    trimmed_poem = []
-    for i in range(0, len(lines), 2):
-        if i + 1 < len(lines):
-            trimmed_poem.append(lines[i] + " " + lines[i + 1])
-        else:
-            trimmed_poem.append(lines[i])
-    return '\n'.join(trimmed_poem)
+# Session state written to disk, so a restart or reconnect does not lose the conversation
+SESSION_KEYS = ["poem_history", "poem_context", "conversation_log", "intents", "actions_done", "user_query", "poem_details", "poem_started"]
 
 # Main Streamlit app
 def main():
     st.title("Sublime Agent: A Versatile AI Poet")
+    restore_session(agent_core.SESSION_DECODERS)
+    render_sidebar()
 
     # Initialize session state variables
     if "conversation_log" not in st.session_state:
         st.session_state.conversation_log = []
     if "intents" not in st.session_state:
         st.session_state.intents = None
-    if "generated_poem" not in st.session_state:
-        st.session_state.generated_poem = None
-    if "poem_state" not in st.session_state:
-        st.session_state.poem_state = "original"
+    if "poem_history" not in st.session_state:
+        st.session_state.poem_history = agent_core.new_poem_history()
     if "actions_done" not in st.session_state:
         st.session_state.actions_done = []
+    if "poem_context" not in st.session_state:
+        st.session_state.poem_context = agent_core.new_poem_context()
+    if "poem_details" not in st.session_state:
+        st.session_state.poem_details = None
+    if "poem_started" not in st.session_state:
+        st.session_state.poem_started = False
+
+    history = st.session_state.poem_history
 
     # User input for query using Pydantic
-    user_query = st.text_input("You:")
+    user_query = st.text_input("You:", key="user_query")
 
     # Handle user submission
     if st.button("Send"):
         unique_id = str(uuid.uuid4())
         st.session_state.conversation_log.append({"id": unique_id, "role": "user", "content": user_query})
-        st.session_state.intents = determine_intent(user_query)
+        st.session_state.intents = None
+        st.session_state.actions_done = []
+        st.session_state.poem_details = None
+        st.session_state.poem_started = False
+        cancel_session_jobs(keep=open_poem_questions())
+        start_job("determine_intent", determine_intent, user_query)
+
+    job = finished_job("determine_intent", "your request")
+    if job:
+        if job.error:
+            handle_server_error(job.error)
+        else:
+            st.session_state.intents = job.result
 
     # Handle intents
     if st.session_state.intents:
@@ -157,103 +131,68 @@ def main():
             if "generate a poem" in st.session_state.intents and "generate a poem" not in st.session_state.actions_done:
                 st.write("Sublime Agent: Processing your request to generate a poem...")
                 st.write("Please specify the poem details below:")
+
+                # The details are read from the query while the dropdowns are shown; each one is
+                # filled in as soon as its value has streamed in and passed validation
+                details = st.session_state.poem_details
+                if details is None:
+                    start_job("extract_details", extract_poem_details, user_query)
+                    job = finished_job("extract_details", "the poem details")
+                    if job:
+                        # Without extracted details the user simply picks every option
+                        details = st.session_state.poem_details = {} if job.error else job.result
+                    else:
+                        details = valid_details(job_progress("extract_details").get("arguments", {}))
+
                 # Dropdowns for poem details
-                st.session_state.style = st.selectbox("Style:", ["classic", "modern", "haiku", "free verse", "sonnet", "limerick"])
-                st.session_state.mood = st.selectbox("Mood:", ["happy", "sad", "romantic", "inspirational", "nostalgic"])
-                st.session_state.tone = st.selectbox("Tone:", ["formal", "informal", "serious", "humorous", "sentimental", "playful"])
-                st.session_state.purpose = st.selectbox(
-                    "Purpose:",
-                    [
-                        "a gift", "personal reflection", "a celebration", "a memorial", "a story",
-                        "parents", "siblings", "lovers", "friends", "children",
-                        "colleagues", "a special occasion", "a wedding", "an anniversary",
-                        "a birthday", "a graduation", "a farewell", "encouragement",
-                        "appreciation", "apology", "condolence", "retirement",
-                        "a boss", "a team manager", "professional recognition", "a work anniversary", "leisure time"
-                    ]
-                )
+                st.session_state.style = st.selectbox("Style:", agent_core.STYLES, index=option_index(agent_core.STYLES, details.get("style")))
+                st.session_state.mood = st.selectbox("Mood:", agent_core.MOODS, index=option_index(agent_core.MOODS, details.get("mood")))
+                st.session_state.tone = st.selectbox("Tone:", agent_core.TONES, index=option_index(agent_core.TONES, details.get("tone")))
+                st.session_state.purpose = st.selectbox("Purpose:", agent_core.PURPOSES, index=option_index(agent_core.PURPOSES, details.get("purpose")))
 
-                # Generate poem button
+                # Generate poem button; when the query named every option the poem is started right away
                 if st.session_state.style and st.session_state.mood and st.session_state.purpose and st.session_state.tone:
                     if st.button("Generate Poem"):
-                        prompt = user_query
-                        poem, source = generate_poem(prompt, style=st.session_state.style, mood=st.session_state.mood,
-                                                    purpose=st.session_state.purpose, tone=st.session_state.tone)
-                        st.session_state.generated_poem = poem
-                        st.session_state.poem_state = "original"
+                        cancel_job("generate_poem")
+                        start_job("generate_poem", generate_poem, user_query, style=st.session_state.style, mood=st.session_state.mood,
+                                  purpose=st.session_state.purpose, tone=st.session_state.tone)
+                    elif all(option in details for option in ("style", "mood", "purpose", "tone")) and not st.session_state.poem_started:
+                        st.session_state.poem_started = True
+                        start_job("generate_poem", generate_poem, user_query, style=details["style"], mood=details["mood"],
+                                  purpose=details["purpose"], tone=details["tone"])
+
+                    job = finished_job("generate_poem", "your poem")
+                    if job and job.error:
+                        handle_server_error(job.error)
+                    elif job:
+                        poem, source = job.result
+                        version = history.add(poem)
                         st.session_state.actions_done.append("generate a poem")
-                        unique_id = str(uuid.uuid4())
-                        st.session_state.conversation_log.append({"id": unique_id, "role": "system", "content": poem})
+                        log_reply(version=version)
                         st.write("Sublime Agent:")
                         st.write(poem)
                         st.caption(f"Source: {source}")
 
-            if "trim a poem" in st.session_state.intents and "trim a poem" not in st.session_state.actions_done and st.session_state.generated_poem:
-                st.write("Sublime Agent: Trimming the poem as requested...")
-                trimmed_poem = trim_poem(st.session_state.generated_poem)
-                st.session_state.generated_poem = trimmed_poem  # Update the generated poem with the trimmed version
-                st.session_state.poem_state = "trimmed"
-                st.session_state.actions_done.append("trim a poem")
-                unique_id = str(uuid.uuid4())
-                st.session_state.conversation_log.append({"id": unique_id, "role": "system", "content": trimmed_poem})
-                st.write("Sublime Agent:")
-                st.write(trimmed_poem)
-
-            if "capitalize text" in st.session_state.intents and "capitalize text" not in st.session_state.actions_done and st.session_state.generated_poem:
-                st.write("Sublime Agent: Capitalizing the text as requested...")
-                capitalized_text = recapitalize(st.session_state.generated_poem)
-                st.session_state.generated_poem = capitalized_text
-                st.session_state.poem_state = "capitalized"
-                st.session_state.actions_done.append("capitalize text")
-                unique_id = str(uuid.uuid4())
-                st.session_state.conversation_log.append({"id": unique_id, "role": "system", "content": capitalized_text})
-                st.write("Sublime Agent:")
-                st.write(capitalized_text)
+            render_intents(history, user_query, lambda error, action: handle_server_error(error))
 
-            if "decapitalize text" in st.session_state.intents and "decapitalize text" not in st.session_state.actions_done and st.session_state.generated_poem:
-                st.write("Sublime Agent: Decapitalizing the text as requested...")
-                decapitalized_text = decapitalize(st.session_state.generated_poem)
-                st.session_state.generated_poem = decapitalized_text
-                st.session_state.poem_state = "decapitalized"
-                st.session_state.actions_done.append("decapitalize text")
-                unique_id = str(uuid.uuid4())
-                st.session_state.conversation_log.append({"id": unique_id, "role": "system", "content": decapitalized_text})
-                st.write("Sublime Agent:")
-                st.write(decapitalized_text)
-
-            if "poem query" in st.session_state.intents and st.session_state.generated_poem:
-                st.write("Sublime Agent: Answering your poem query...")
-                poem_query_response = handle_poem_query(st.session_state.generated_poem, user_query)
-                unique_id = str(uuid.uuid4())
-                st.session_state.conversation_log.append({"id": unique_id, "role": "system", "content": poem_query_response})
-                st.write("Sublime Agent:")
-                st.write(poem_query_response)
-
-            if "general query" in st.session_state.intents:
-                st.write("Sublime Agent: Routing your query to GPT...")
-                response = openai.chat.completions.create(
-                    model="gpt-4-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant. Take user query and output relevant answer. If you don't know the answer, like a good AI assistant say, 'Sorry! I don't know the answer!'"},
-                        {"role": "user", "content": user_query}
-                    ]
-                )
-                gpt_response = response.choices[0].message.content.strip()
-                unique_id = str(uuid.uuid4())
-                st.session_state.conversation_log.append({"id": unique_id, "role": "system", "content": gpt_response})
-                st.write("Sublime Agent:")
-                st.write(gpt_response)
-                
         except Exception as e:
             handle_server_error(e)
         
+    render_poem_answers(lambda error, action: handle_server_error(error))
+
+    render_poem_history(history)
+
         # Display conversation log
     st.header("Conversation Log")
     for message in st.session_state.conversation_log:
         if message['role'] == "user":
             st.text_area("You:", message['content'], key=message['id'])
         elif message['role'] == "system":
-            st.text_area("Sublime Agent:", message['content'], key=message['id'])
+            # Poem versions are stored by reference and only rebuilt when shown
+            content = message['content'] if 'content' in message else history.text(message['version'])
+            st.text_area("Sublime Agent:", content, key=message['id'])
+
+    save_session(SESSION_KEYS)
 
 if __name__ == "__main__":
     main()
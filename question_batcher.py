@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
+from functools import partial
+import llm
+import metrics
+
+# Most questions answered by one model call; 1 turns batching off
+BATCH_SIZE = int(os.getenv("SUBLIME_BATCH_SIZE", "5"))
+
+# Seconds the first question of a batch waits for the session's next questions about the same poem
+BATCH_WAIT = float(os.getenv("SUBLIME_BATCH_WAIT", "1"))
+
+BATCH_PROMPT = (
+    "Answer each of the following {count} questions about the poem separately.\n\n{questions}\n\n"
+    'Reply with a JSON object of the form {{"answers": ["...", "..."]}} holding exactly one answer '
+    "per question, in the same order."
+)
+
+_open_batches = {}
+_lock = threading.Lock()
+
+
+# Questions about one poem from one session that are waiting to be sent together
+class _Batch:
+    def __init__(self, key, poem, context, call):
+        self.key = key
+        self.poem = poem
+        self.context = context
+        self.call = call
+        self.items = []
+        self.full = threading.Event()
+
+
+# Function to queue a question in the session's open batch for the poem. A session's PoemContext
+# is keyed by the poem's base version (see use_poem), so edits of one poem share a batch; the first
+# question of a batch makes its caller the batch's leader
+def _join(poem, question, context, call):
+    key = (context, context.poem_id)
+    future = Future()
+    with _lock:
+        batch = _open_batches.get(key)
+        leader = batch is None
+        if leader:
+            batch = _open_batches[key] = _Batch(key, poem, context, call)
+        batch.items.append((question, future, time.monotonic()))
+        if len(batch.items) >= BATCH_SIZE:
+            del _open_batches[key]
+            batch.full.set()
+    return batch, future, leader
+
+
+# Function run by the leader: wait for the batch to fill up or time out, then answer all of it
+def _dispatch(batch):
+    batch.full.wait(BATCH_WAIT)
+    with _lock:
+        if _open_batches.get(batch.key) is batch:
+            del _open_batches[batch.key]
+    questions = [question for question, _, _ in batch.items]
+    started = time.monotonic()
+    for _, _, queued_at in batch.items:
+        metrics.observe("batch.wait", started - queued_at)
+    metrics.observe("batch.size", len(questions))
+    metrics.incr("batch.questions", len(questions))
+    try:
+        if len(questions) == 1:
+            answers = [_answer_one(batch.poem, questions[0], batch.context, batch.call)]
+        else:
+            answers = _answer_many(batch.poem, questions, batch.context, batch.call)
+    except Exception as e:
+        for _, future, _ in batch.items:
+            future.set_exception(e)
+        return
+    for (_, future, _), answer in zip(batch.items, answers):
+        future.set_result(answer)
+
+
+def _answer_one(poem, question, context, call):
+    metrics.incr("batch.calls")
+    response = call(context.messages(poem, question))
+    answer = response.choices[0].message.content.strip()
+    context.record(question, answer, response.usage)
+    return answer
+
+
+# Function to answer several questions with one structured request, splitting the answers back
+def _answer_many(poem, questions, context, call):
+    numbered = "\n".join(f"{number}. {question}" for number, question in enumerate(questions, 1))
+    prompt = BATCH_PROMPT.format(count=len(questions), questions=numbered)
+    metrics.incr("batch.calls")
+    response = call(context.messages(poem, prompt), response_format={"type": "json_object"})
+    try:
+        answers = json.loads(response.choices[0].message.content)["answers"]
+        if len(answers) != len(questions) or not all(isinstance(answer, str) for answer in answers):
+            raise ValueError("answers do not match the questions")
+    except (ValueError, KeyError, TypeError):
+        # The model did not follow the format, so ask the questions one at a time instead
+        metrics.incr("batch.split_failures")
+        return [_answer_one(poem, question, context, call) for question in questions]
+
+    metrics.incr("batch.calls_saved", len(questions) - 1)
+    answers = [answer.strip() for answer in answers]
+    for number, (question, answer) in enumerate(zip(questions, answers)):
+        context.record(question, answer, response.usage if number == 0 else None)
+    return answers
+
+
+# Function to answer a question about a poem. Questions about the same poem that the session asks
+# within BATCH_WAIT seconds, e.g. follow-up messages, share a single model call
+def answer_questions(poem, user_query, context, call=None):
+    return answer_queries(poem, [user_query], context, call)[0]
+
+
+# Function to answer several questions about the same poem, e.g. routed from one query; they join
+# the session's open batch like separate messages would. Returns one answer per question
+def answer_queries(poem, user_queries, context, call=None):
+    call = call or partial(llm.chat, "handle_poem_query")
+    entries = [_join(poem, user_query, context, call) for user_query in user_queries]
+    for batch, _, leader in entries:
+        if leader:
+            _dispatch(batch)
+    return [future.result() for _, future, _ in entries]
@@ -0,0 +1,37 @@
+import uuid
+import streamlit as st
+from agent_core import handle_poem_query
+from job_widgets import start_job, finished_job, is_active
+
+# Every question about the poem runs as a job of its own. A question waits up to
+# question_batcher.BATCH_WAIT seconds for the session's next questions about the same poem, which
+# then share its model call, so sending the next message must not cancel it: pass
+# open_poem_questions() as `keep` to cancel_session_jobs.
+
+
+# Function to list the job names of the session's questions that have not been answered yet
+def open_poem_questions():
+    if "poem_questions" not in st.session_state:
+        st.session_state.poem_questions = []
+    return st.session_state.poem_questions
+
+
+# Function to ask a question about the current poem in the background
+def ask_poem_question(history, user_query):
+    name = f"poem query {uuid.uuid4()}"
+    st.session_state.poem_context.use_poem(history.base())
+    start_job(name, handle_poem_query, history.text(), user_query, st.session_state.poem_context)
+    open_poem_questions().append(name)
+
+
+# Function to collect the session's answered questions, oldest first; a question whose job was
+# lost, e.g. to a restart, is dropped
+def finished_poem_questions():
+    finished = []
+    for name in list(open_poem_questions()):
+        job = finished_job(name, "your poem query")
+        if job is not None:
+            finished.append(job)
+        if job is not None or not is_active(name):
+            open_poem_questions().remove(name)
+    return finished
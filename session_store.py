@@ -0,0 +1,167 @@
+import json
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+import metrics
+
+# Directory holding one snapshot file per session
+SESSION_DIR = os.getenv("SUBLIME_SESSION_DIR", ".sessions")
+
+# Snapshots not written to for this many seconds are deleted (default one week)
+SESSION_TTL = float(os.getenv("SUBLIME_SESSION_TTL", str(7 * 24 * 3600)))
+
+# After this many incremental records a session file is rewritten as one full snapshot
+COMPACT_AFTER = 64
+
+# Expired snapshots are deleted every this many saves, so a long-running server does not keep
+# every reconnect's copy of a session until it restarts
+PRUNE_EVERY = 256
+
+COMPRESSION_LEVEL = 6
+
+# Session tokens are uuid4 strings; anything else is refused so it cannot name another path
+_TOKEN_PATTERN = re.compile(r"^[0-9a-f]{8}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{4}-?[0-9a-f]{12}$")
+
+# Every record is a 4-byte length followed by zlib-compressed JSON
+_HEADER = struct.Struct(">I")
+
+
+# Function to describe how new differs from old: lists that grew (or slid forward, like the
+# recent turns of a prompt context) store only the new items, dicts store their changed keys and
+# anything else is stored whole; None means nothing changed
+def diff(old, new):
+    if old == new:
+        return None
+    if isinstance(old, list) and isinstance(new, list) and new:
+        for start in range(len(old)):
+            kept = len(old) - start
+            if kept <= len(new) and old[start] == new[0] and new[:kept] == old[start:]:
+                return {"shift": start, "extend": new[kept:]}
+    if isinstance(old, dict) and isinstance(new, dict):
+        fields = {}
+        for key, value in new.items():
+            change = diff(old[key], value) if key in old else {"set": value}
+            if change is not None:
+                fields[key] = change
+        return {"fields": fields, "drop": [key for key in old if key not in new]}
+    return {"set": new}
+
+
+# Function to apply a diff() result, returning the new value without modifying old
+def patch(old, delta):
+    if "set" in delta:
+        return delta["set"]
+    if "extend" in delta:
+        return old[delta["shift"]:] + delta["extend"]
+    value = dict(old)
+    for key in delta["drop"]:
+        value.pop(key, None)
+    for key, change in delta["fields"].items():
+        value[key] = patch(value.get(key), change)
+    return value
+
+
+def _encode(record):
+    payload = zlib.compress(json.dumps(record, separators=(",", ":")).encode(), COMPRESSION_LEVEL)
+    return _HEADER.pack(len(payload)) + payload
+
+
+# Compressed, append-only session snapshots on local disk, so sessions survive restarts
+class SessionStore:
+    def __init__(self, directory=SESSION_DIR):
+        self.directory = directory
+        self._records = {}
+        self._saves = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def valid_token(self, token):
+        return bool(token) and bool(_TOKEN_PATTERN.match(token))
+
+    def path(self, token):
+        if not self.valid_token(token):
+            raise ValueError(f"Invalid session token: {token!r}")
+        return os.path.join(self.directory, f"{token}.snap")
+
+    # Function to persist what changed since the previous snapshot of this session; returns the
+    # snapshot it stored, a deep copy that later changes to the session's own objects cannot reach,
+    # so pass it back as `previous` next time
+    def save(self, token, previous, state):
+        state = json.loads(json.dumps(state))
+        delta = diff(previous, state)
+        if delta is None:
+            return state
+        start = time.perf_counter()
+        with self._lock:
+            if self._records.get(token, 0) >= COMPACT_AFTER:
+                written = self._write(token, state)
+            else:
+                written = self._append(token, delta)
+            self._saves += 1
+            due = self._saves % PRUNE_EVERY == 0
+        metrics.observe("session_store.save_latency", time.perf_counter() - start)
+        metrics.incr("session_store.bytes_written", written)
+        if due:
+            self.prune()
+        return state
+
+    # Function to read a session back; None when the token has no snapshot
+    def load(self, token):
+        start = time.perf_counter()
+        try:
+            with open(self.path(token), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        state = {}
+        records = 0
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            (size,) = _HEADER.unpack_from(data, offset)
+            try:
+                state = patch(state, json.loads(zlib.decompress(data[offset + _HEADER.size:offset + _HEADER.size + size])))
+            except (zlib.error, ValueError):
+                # A record cut short by a crash; everything before it is still good, and the next
+                # save rewrites the file so later records are not appended after the broken one
+                metrics.incr("session_store.corrupt_records")
+                records = COMPACT_AFTER
+                break
+            offset += _HEADER.size + size
+            records += 1
+        with self._lock:
+            self._records[token] = records
+        metrics.incr("session_store.restores")
+        metrics.observe("session_store.restore_latency", time.perf_counter() - start)
+        return state
+
+    # Function to delete snapshots nobody has written to within max_age seconds
+    def prune(self, max_age=SESSION_TTL):
+        cutoff = time.time() - max_age
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if name.endswith(".snap") and os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except FileNotFoundError:
+                # Another thread pruned it first
+                continue
+
+    def _append(self, token, delta):
+        record = _encode(delta)
+        with open(self.path(token), "ab") as f:
+            f.write(record)
+        self._records[token] = self._records.get(token, 0) + 1
+        return len(record)
+
+    # Rewrites the file as a single full snapshot; the rename keeps a crash from losing the old one
+    def _write(self, token, state):
+        record = _encode({"set": state})
+        path = self.path(token)
+        with open(path + ".tmp", "wb") as f:
+            f.write(record)
+        os.replace(path + ".tmp", path)
+        self._records[token] = 1
+        return len(record)
@@ -0,0 +1,48 @@
+import threading
+import streamlit as st
+import metrics
+from job_widgets import get_session_id
+from session_store import SessionStore
+
+_store = None
+_store_lock = threading.Lock()
+
+
+# Function to open the process-wide snapshot store, pruning expired sessions once at startup
+def get_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore()
+            _store.prune()
+        return _store
+
+
+# Function to restore a session when the browser reconnects with its ?session= token;
+# call it before the app initializes its state. decoders rebuild objects saved with to_dict()
+def restore_session(decoders):
+    if "session_id" in st.session_state:
+        return
+    store = get_store()
+    token = st.query_params.get("session")
+    state = store.load(token) if store.valid_token(token) else None
+    # Every connection writes under a token of its own: a reopened link forks the saved session,
+    # so two tabs opened from the same link never append to one file or share jobs
+    st.query_params["session"] = get_session_id()
+    st.session_state.saved_snapshot = {}
+    for key, value in (state or {}).items():
+        st.session_state[key] = decoders[key](value) if key in decoders else value
+
+
+# Function to write whatever changed in the given session keys since the last snapshot
+def save_session(keys):
+    state = {}
+    for key in keys:
+        if key in st.session_state:
+            value = st.session_state[key]
+            state[key] = value.to_dict() if hasattr(value, "to_dict") else value
+    try:
+        st.session_state.saved_snapshot = get_store().save(get_session_id(), st.session_state.saved_snapshot, state)
+    except (OSError, TypeError, ValueError):
+        # Persistence is best effort and must never break the app
+        metrics.incr("session_store.errors")
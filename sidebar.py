@@ -0,0 +1,95 @@
+import streamlit as st
+import circuit_breaker
+import fallback_poet
+import llm
+import metrics
+import usage_ledger
+from job_widgets import get_session_id
+
+
+def _seconds(value):
+    return "-" if value is None else f"{value:.1f}s"
+
+
+def _milliseconds(value):
+    return "-" if value is None else f"{value * 1000:.1f} ms"
+
+
+# Function to show upstream health, latency and degraded-mode metrics in the sidebar
+def render_sidebar():
+    counters = metrics.snapshot()["counters"]
+    operations = sorted(
+        name[len("llm."):-len(".calls")] for name in counters
+        if name.startswith("llm.") and name.endswith(".calls")
+    )
+    for name, breaker in circuit_breaker.breaker_states().items():
+        if breaker["state"] == circuit_breaker.OPEN:
+            st.sidebar.warning(f"{name} is failing; requests are paused for {breaker['retry_after']:.0f}s and poems are written offline.")
+        elif breaker["state"] == circuit_breaker.HALF_OPEN:
+            st.sidebar.info(f"{name} is recovering; probing with a few requests.")
+    with st.sidebar.expander("Upstream health"):
+        breakers = circuit_breaker.breaker_states()
+        if not breakers:
+            st.caption("No requests yet.")
+        for name, breaker in breakers.items():
+            st.caption(f"{name}: {breaker['state']} · {breaker['calls']} calls in window · {breaker['failure_rate']:.0%} failing")
+    with st.sidebar.expander("Upstream latency"):
+        if not operations:
+            st.caption("No requests yet.")
+        for operation in operations:
+            stats = llm.hedge_stats(operation)
+            st.markdown(f"**{operation}**")
+            st.caption(
+                f"{stats['calls']} calls · hedge rate {stats['hedge_rate']:.0%} · "
+                f"p99 {_seconds(stats['p99'])} · unhedged p99 {_seconds(stats['primary_p99'])}"
+            )
+            first_chunk = metrics.percentile(f"llm.{operation}.first_chunk", 50)
+            if first_chunk is not None:
+                st.caption(f"streamed · first chunk p50 {_seconds(first_chunk)}")
+    with st.sidebar.expander("Degraded mode"):
+        poems = metrics.counter("fallback.poems")
+        st.caption(
+            f"{poems} fallback poems · p99 {_milliseconds(metrics.percentile('fallback.latency', 99))} · "
+            f"{metrics.counter('fallback.over_budget')} over the {fallback_poet.LATENCY_BUDGET * 1000:.0f} ms budget"
+        )
+    with st.sidebar.expander("Prompt context"):
+        sent = metrics.counter("context.tokens_sent")
+        full_history = metrics.counter("context.tokens_full_history")
+        if not sent:
+            st.caption("No follow-up questions yet.")
+        else:
+            st.caption(
+                f"~{sent} prompt tokens sent for {metrics.counter('context.calls')} questions "
+                f"(~{full_history} if every turn were resent) · "
+                f"{metrics.counter('context.cached_tokens')} tokens served from the provider's prompt cache"
+            )
+    with st.sidebar.expander("Question batching"):
+        questions = metrics.counter("batch.questions")
+        if not questions:
+            st.caption("No poem questions yet.")
+        else:
+            st.caption(
+                f"{questions} questions answered in {metrics.counter('batch.calls')} calls · "
+                f"{metrics.counter('batch.calls_saved')} calls saved · "
+                f"added wait p99 {_milliseconds(metrics.percentile('batch.wait', 99))}"
+            )
+    with st.sidebar.expander("Response cache"):
+        for operation in ("determine_intent", "general_query"):
+            hits = metrics.counter(f"cache.{operation}.hits")
+            misses = metrics.counter(f"cache.{operation}.misses")
+            st.caption(f"{operation}: {hits} hits · {misses} misses")
+    with st.sidebar.expander("Usage"):
+        usage = usage_ledger.get_ledger().usage(get_session_id())
+        st.caption(
+            f"This session: {usage['session_tokens']} / {usage_ledger.SESSION_TOKENS_PER_MINUTE} tokens · "
+            f"{usage['session_requests']} / {usage_ledger.SESSION_REQUESTS_PER_MINUTE} requests in the last minute"
+        )
+        st.caption(
+            f"All sessions: {usage['tokens']} / {usage_ledger.GLOBAL_TOKENS_PER_MINUTE} tokens · "
+            f"{usage['requests']} / {usage_ledger.GLOBAL_REQUESTS_PER_MINUTE} requests in the last minute"
+        )
+        st.caption(
+            f"{usage['queued']} waiting · {metrics.counter('admission.queued')} queued and "
+            f"{metrics.counter('admission.rejected')} rejected so far · "
+            f"queue wait p99 {_milliseconds(metrics.percentile('admission.wait', 99))}"
+        )
@@ -0,0 +1,26 @@
+import pytest
+
+openai = pytest.importorskip("openai")
+pytest.importorskip("tenacity")
+
+import httpx
+import agent_core
+import llm
+
+
+def _server_error(operation, messages, **kwargs):
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    raise openai.InternalServerError("upstream down", response=httpx.Response(500, request=request), body=None)
+
+
+def _connection_error(operation, messages, **kwargs):
+    raise openai.APIConnectionError(request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+
+
+@pytest.mark.parametrize("failure", [_server_error, _connection_error])
+def test_poem_falls_back_when_the_api_is_down(monkeypatch, failure):
+    monkeypatch.setattr(llm, "chat", failure)
+    poem, source = agent_core.generate_poem("the sea", "haiku", "sad", "a friend", "serious")
+
+    assert source == agent_core.FALLBACK_SOURCE
+    assert poem
@@ -0,0 +1,85 @@
+from types import SimpleNamespace
+import pytest
+import circuit_breaker
+from circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(circuit_breaker, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def _calls(breaker, *outcomes):
+    for ok in outcomes:
+        breaker.before_call()
+        breaker.after_call(ok, 0.1)
+
+
+def _opened(clock):
+    breaker = CircuitBreaker("test")
+    _calls(breaker, True, True, False, False, False)
+    return breaker
+
+
+def test_stays_closed_until_enough_calls(clock):
+    breaker = CircuitBreaker("test")
+    _calls(breaker, False, False, False, False)
+    assert breaker.state == CLOSED
+
+
+def test_opens_when_the_failure_rate_is_reached(clock):
+    breaker = _opened(clock)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen) as error:
+        breaker.before_call()
+    assert error.value.retry_after == pytest.approx(circuit_breaker.OPEN_SECONDS)
+
+
+def test_slow_calls_count_as_failures(clock):
+    breaker = CircuitBreaker("test")
+    for _ in range(circuit_breaker.MIN_CALLS):
+        breaker.before_call()
+        breaker.after_call(True, circuit_breaker.SLOW_CALL_SECONDS)
+    assert breaker.state == OPEN
+
+
+def test_half_open_after_the_open_period_with_limited_probes(clock):
+    breaker = _opened(clock)
+    clock[0] += circuit_breaker.OPEN_SECONDS
+    for _ in range(circuit_breaker.HALF_OPEN_PROBES):
+        breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+
+def test_closes_when_every_probe_succeeds(clock):
+    breaker = _opened(clock)
+    clock[0] += circuit_breaker.OPEN_SECONDS
+    _calls(breaker, *[True] * circuit_breaker.HALF_OPEN_PROBES)
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()["calls"] == 0
+
+
+def test_a_failed_probe_opens_again(clock):
+    breaker = _opened(clock)
+    clock[0] += circuit_breaker.OPEN_SECONDS
+    _calls(breaker, False)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
+
+
+def test_released_probe_frees_its_slot(clock):
+    breaker = _opened(clock)
+    clock[0] += circuit_breaker.OPEN_SECONDS
+    for _ in range(circuit_breaker.HALF_OPEN_PROBES):
+        breaker.before_call()
+    # A cancelled probe ends without a verdict and lets another probe through
+    breaker.release()
+    breaker.before_call()
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpen):
+        breaker.before_call()
@@ -0,0 +1,82 @@
+import threading
+import time
+import context_window
+from context_window import PoemContext
+from poem_history import PoemHistory
+
+OPERATIONS = {"trimmed": lambda text: text, "capitalized": str.upper}
+
+
+def _ask(context, history, question, answer):
+    context.use_poem(history.base())
+    context.messages(history.text(), question)
+    context.record(question, answer)
+
+
+def test_edits_keep_the_conversation_about_their_poem():
+    history = PoemHistory(OPERATIONS)
+    context = PoemContext("system")
+    history.add("Roses are red")
+    _ask(context, history, "What is the meter?", "Trochaic.")
+    history.apply("capitalized")
+    _ask(context, history, "And now?", "Still trochaic.")
+
+    assert context.turns == [("What is the meter?", "Trochaic."), ("And now?", "Still trochaic.")]
+
+
+def test_a_new_poem_starts_a_new_conversation():
+    history = PoemHistory(OPERATIONS)
+    context = PoemContext("system", history_budget=20)
+    history.add("Roses are red")
+    for number in range(5):
+        _ask(context, history, f"Question {number} about roses?", "An answer about roses.")
+    assert context.summary
+
+    history.add("Violets are blue")
+    context.use_poem(history.base())
+    messages = context.messages(history.text(), "What is the rhyme?")
+
+    assert not context.turns and not context.summary
+    assert not any("roses" in message["content"] for message in messages)
+
+
+def test_poem_id_survives_a_snapshot():
+    context = PoemContext("system")
+    context.use_poem(3)
+    context.record("Why?", "Because.")
+    restored = PoemContext.from_dict(context.to_dict())
+    restored.use_poem(3)
+
+    assert restored.turns == [("Why?", "Because.")]
+
+
+def test_jobs_sharing_a_context_lose_no_turns(monkeypatch):
+    gist = context_window._gist
+    folded = []
+
+    # Folding a turn yields to the other threads, which is where an unlocked context loses turns
+    def slow_gist(question, answer):
+        folded.append(question)
+        time.sleep(0.0005)
+        return gist(question, answer)
+
+    monkeypatch.setattr(context_window, "_gist", slow_gist)
+    context = PoemContext("system", history_budget=40)
+    context.use_poem(0)
+
+    def ask(job):
+        for number in range(50):
+            context.messages("Roses are red", f"Job {job} question {number}?")
+            context.record(f"Job {job} question {number}?", "An answer.")
+            context.to_dict()
+
+    threads = [threading.Thread(target=ask, args=(job,)) for job in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Every turn is either still recent or was folded into the summary exactly once
+    context.messages("Roses are red", "Last question?")
+    kept = folded + [question for question, _ in context.turns]
+    assert sorted(kept) == sorted(f"Job {job} question {number}?" for job in range(4) for number in range(50))
@@ -0,0 +1,31 @@
+import pytest
+from fallback_poet import RHYMES, fallback_poem
+
+
+def _rhyme_group(line):
+    end = line.rstrip(".,!?").split()[-1].lower()
+    return next(index for index, group in enumerate(RHYMES) if end in group)
+
+
+@pytest.mark.parametrize("prompt", [f"the sea {number}" for number in range(50)])
+def test_rhyme_letters_never_share_a_sound(prompt):
+    lines = fallback_poem(prompt, "sonnet", "sad", tone="serious").split("\n")
+    stanzas = [line for line in lines if line][:14]
+    groups = [_rhyme_group(line) for line in stanzas]
+    scheme = "ABABCDCDEFEFGG"
+    for letter in set(scheme):
+        assert len({groups[i] for i, l in enumerate(scheme) if l == letter}) == 1
+    assert len(set(groups)) == len(set(scheme))
+
+
+@pytest.mark.parametrize("style, count", [("haiku", 3), ("limerick", 5), ("sonnet", 17)])
+def test_fixed_forms_get_no_closing_or_dedication_line(style, count):
+    poem = fallback_poem("the sea", style, "sad", purpose="a gift", tone="playful")
+    assert len(poem.split("\n")) == count
+    assert "a gift" not in poem
+
+
+def test_free_forms_keep_the_closing_and_dedication_lines():
+    poem = fallback_poem("the sea", "modern", "sad", purpose="a gift", tone="playful")
+    assert poem.split("\n")[-2].startswith("La-di-da")
+    assert poem.split("\n")[-1] == "— for a gift"
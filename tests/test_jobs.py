@@ -0,0 +1,124 @@
+import threading
+import time
+import uuid
+import pytest
+import jobs
+
+
+class _HeldExecutor:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn):
+        self.submitted.append(fn)
+
+
+@pytest.fixture
+def session_id():
+    session_id = str(uuid.uuid4())
+    yield session_id
+    jobs.cancel_session_jobs(session_id)
+
+
+def _wait_until_done(job):
+    deadline = time.monotonic() + 5
+    while not job.done():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_an_unfinished_job_is_reused(session_id):
+    release = threading.Event()
+    first = jobs.submit_job(session_id, "poem", release.wait, 5)
+
+    assert jobs.submit_job(session_id, "poem", release.wait, 5) is first
+    assert jobs.submit_job(session_id, "other", release.wait, 5) is not first
+    assert jobs.submit_job(str(uuid.uuid4()), "poem", release.wait, 5) is not first
+
+    first.cancel()
+    assert jobs.submit_job(session_id, "poem", release.wait, 5) is not first
+    release.set()
+
+
+def test_cancel_before_the_job_runs(session_id, monkeypatch):
+    executor = _HeldExecutor()
+    monkeypatch.setattr(jobs, "_executor", executor)
+    calls = []
+    job = jobs.submit_job(session_id, "poem", calls.append, 1)
+
+    job.cancel()
+    assert job.status == "cancelled" and job.done()
+
+    executor.submitted[0]()
+    assert job.status == "cancelled"
+    assert calls == []
+
+
+def test_cancel_while_the_job_runs(session_id):
+    started, release = threading.Event(), threading.Event()
+
+    def work():
+        started.set()
+        release.wait(5)
+        return "poem"
+
+    job = jobs.submit_job(session_id, "poem", work)
+    assert started.wait(5)
+
+    job.cancel()
+    assert job.status == "running" and not job.done()
+
+    release.set()
+    _wait_until_done(job)
+    assert job.status == "cancelled" and job.result is None
+
+
+def test_keep_spares_named_jobs(session_id):
+    release = threading.Event()
+    kept = jobs.submit_job(session_id, "question", release.wait, 5)
+    other = jobs.submit_job(session_id, "poem", release.wait, 5)
+
+    assert jobs.cancel_session_jobs(session_id, keep=["question"]) == 1
+    assert other.cancel_event.is_set() and not kept.cancel_event.is_set()
+    release.set()
+
+
+def test_finished_jobs_expire_after_the_ttl(session_id, monkeypatch):
+    job = jobs.submit_job(session_id, "poem", lambda: "poem")
+    _wait_until_done(job)
+    assert jobs.get_job(job.id) is job
+
+    monkeypatch.setattr(jobs, "JOB_TTL_SECONDS", 0)
+    job.finished_at -= 1
+    jobs.submit_job(session_id, "other", lambda: None)
+
+    assert jobs.get_job(job.id) is None
+
+
+class _SlowEvent(threading.Event):
+    # Reading the event takes a while, which leaves room for a cancel() from another thread
+    def is_set(self):
+        value = super().is_set()
+        time.sleep(0.02)
+        return value
+
+
+def test_a_job_reported_cancelled_never_starts(session_id, monkeypatch):
+    executor = _HeldExecutor()
+    monkeypatch.setattr(jobs, "_executor", executor)
+    calls = []
+    job = jobs.submit_job(session_id, "poem", calls.append, 1)
+    job.cancel_event = _SlowEvent()
+    runner = threading.Thread(target=executor.submitted[0])
+    runner.start()
+    time.sleep(0.01)
+
+    job.cancel()
+    reported, ran = job.status, list(calls)
+    runner.join()
+
+    # A job reported cancelled has nothing left to run; one that was already running is only
+    # asked to stop, and is reported cancelled once its function returns
+    if reported == "cancelled":
+        assert calls == ran
+    assert job.done()
@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("openai")
+
+import llm
+import metrics
+
+
+class _SlowCompletions:
+    async def create(self, timeout=None, **request):
+        await asyncio.sleep(10)
+
+
+def test_timed_out_hedged_operation_is_one_breaker_verdict(monkeypatch):
+    monkeypatch.setattr(llm, "_client", SimpleNamespace(chat=SimpleNamespace(completions=_SlowCompletions())))
+    monkeypatch.setattr(llm, "hedge_delay", lambda operation: 0.01)
+    model = "test-hedged-timeout"
+
+    with pytest.raises(llm.DeadlineExceeded):
+        llm.chat("test", [{"role": "user", "content": "hi"}], model=model, deadline=0.2)
+
+    state = llm.breaker_for(model).snapshot()
+    assert state["calls"] == 1 and state["failure_rate"] == 1.0
+
+
+class _SlowPrimaryCompletions:
+    def __init__(self):
+        self.requests = 0
+        self.primary_cancelled = asyncio.Event()
+
+    async def create(self, timeout=None, **request):
+        self.requests += 1
+        if self.requests == 1:
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                self.primary_cancelled.set()
+                raise
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=f"reply {self.requests}"))], usage=None)
+
+
+def test_first_response_wins_and_the_other_is_cancelled(monkeypatch):
+    completions = _SlowPrimaryCompletions()
+    monkeypatch.setattr(llm, "_client", SimpleNamespace(chat=SimpleNamespace(completions=completions)))
+    monkeypatch.setattr(llm, "hedge_delay", lambda operation: 0.01)
+    monkeypatch.setattr(llm, "SHADOW_RATE", 0)
+
+    response = llm.chat("test", [{"role": "user", "content": "hi"}], model="test-hedge-wins", deadline=5)
+
+    assert response.choices[0].message.content == "reply 2"
+    asyncio.run_coroutine_threadsafe(asyncio.wait_for(completions.primary_cancelled.wait(), 1), llm._get_loop()).result()
+
+
+def test_hedge_delay_follows_the_primaries_latency(monkeypatch):
+    monkeypatch.setattr(llm, "HEDGE_PERCENTILE", 50)
+    for _ in range(llm.MIN_HEDGE_SAMPLES):
+        metrics.observe("llm.test-delay.primary_latency", 2.0)
+        metrics.observe("llm.test-delay.latency", 0.5)
+
+    assert llm.hedge_delay("test-delay") == 2.0
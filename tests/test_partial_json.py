@@ -0,0 +1,50 @@
+import json
+import pytest
+from partial_json import PartialObject
+
+
+def _feed_in_pieces(text, size=1):
+    parser = PartialObject()
+    seen = []
+    for start in range(0, len(text), size):
+        completed = parser.feed(text[start:start + size])
+        seen += list(completed.items())
+    return parser, seen
+
+
+def test_a_number_is_reported_only_once_it_is_complete():
+    parser = PartialObject()
+    assert parser.feed('{"count": 12') == {}
+    assert parser.feed("5") == {}
+    assert parser.feed(", ") == {"count": 125}
+    assert parser.feed('"ok": tru') == {}
+    assert parser.feed("e") == {}
+    assert parser.feed("}") == {"ok": True}
+    assert parser.complete
+
+
+def test_a_string_with_escaped_quotes():
+    parser = PartialObject()
+    assert parser.feed('{"prompt": "the \\"sea') == {}
+    assert parser.feed('\\" at night"') == {"prompt": 'the "sea" at night'}
+
+
+@pytest.mark.parametrize("text", [
+    '{"style": "haiku", "tone": {"voice": ["soft", "low"], "level": 2}, "rhymes": null, "mood": "sad"}',
+    '{\n  "style" : "haiku" ,\n  "lines" : 3 ,\n  "done" : false\n}',
+    '{"a":1,"b":-2.5e3,"c":[1,{"d":"}"}]}',
+])
+def test_fields_arrive_once_and_in_order(text):
+    expected = json.loads(text)
+    for size in (1, 3, len(text)):
+        parser, seen = _feed_in_pieces(text, size)
+        assert seen == list(expected.items())
+        assert parser.fields == expected == parser.result()
+        assert parser.complete
+
+
+def test_nothing_is_reported_before_the_value_arrives():
+    parser = PartialObject()
+    for piece in ['{', '"sty', 'le"', ' ', ':', ' ', '"hai']:
+        assert parser.feed(piece) == {}
+    assert parser.feed('ku"}') == {"style": "haiku"}
@@ -0,0 +1,93 @@
+import pytest
+from poem_history import PoemHistory
+
+
+class _Operations(dict):
+    def __init__(self):
+        super().__init__(upper=self._counted(str.upper), lower=self._counted(str.lower), exclaim=self._counted(lambda text: text + "!"))
+        self.applied = 0
+
+    def _counted(self, operation):
+        def apply(text):
+            self.applied += 1
+            return operation(text)
+        return apply
+
+
+@pytest.fixture
+def history():
+    history = PoemHistory(_Operations())
+    history.add("Roses are red")
+    return history
+
+
+def test_undo_and_redo_walk_the_edits(history):
+    history.apply("upper")
+    history.apply("exclaim")
+
+    assert history.undo() == 1 and history.text() == "ROSES ARE RED"
+    assert history.undo() == 0 and history.text() == "Roses are red"
+    assert not history.can_undo()
+    assert history.redo() == 1
+    assert history.redo() == 2 and history.text() == "ROSES ARE RED!"
+    assert not history.can_redo()
+
+
+def test_a_new_edit_clears_redo(history):
+    history.apply("upper")
+    history.undo()
+    assert history.can_redo()
+
+    history.apply("exclaim")
+
+    assert not history.can_redo()
+    assert history.text() == "Roses are red!"
+
+
+def test_checkout_branches_from_an_earlier_version(history):
+    history.apply("upper")
+    history.checkout(0)
+    branch = history.apply("lower")
+
+    assert history.label(branch) == "lower"
+    assert history.describe(branch) == "v3: lower from v1"
+    assert history.text(branch) == "roses are red"
+    assert history.text(1) == "ROSES ARE RED"
+    assert history.base(branch) == history.base(1) == 0
+    with pytest.raises(ValueError):
+        history.checkout(7)
+
+
+def test_text_is_rebuilt_from_the_nearest_cached_ancestor():
+    operations = _Operations()
+    history = PoemHistory(operations, cache_size=2)
+    history.add("Roses are red")
+    for _ in range(3):
+        history.apply("exclaim")
+    assert history.text() == "Roses are red!!!"
+    assert operations.applied == 3
+
+    history.apply("upper")
+    assert history.text() == "ROSES ARE RED!!!"
+    assert operations.applied == 4
+
+    # v3 has been evicted by now, so it is rebuilt from the cached v2 with a single edit
+    history.text(1)
+    history.text(2)
+    operations.applied = 0
+    assert history.text(3) == "Roses are red!!!"
+    assert operations.applied == 1
+
+
+def test_snapshot_round_trip(history):
+    history.apply("upper")
+    history.apply("exclaim")
+    history.undo()
+    history.add("Violets are blue")
+
+    restored = PoemHistory.from_dict(history.to_dict(), history.operations)
+
+    assert restored.to_dict() == history.to_dict()
+    assert restored.text(2) == "ROSES ARE RED!"
+    assert restored.text() == "Violets are blue"
+    assert restored.undo() == 1
@@ -0,0 +1,19 @@
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("pydantic")
+pytest.importorskip("openai")
+pytest.importorskip("tenacity")
+
+from poem_instructor1 import valid_details
+
+
+@pytest.mark.parametrize("details, valid", [
+    ({"style": "Haiku", "mood": "angry", "prompt": "Sea", "tone": "playful"}, {"style": "haiku", "prompt": "Sea", "tone": "playful"}),
+    ({"style": "haiku", "mood": "happy", "purpose": "A Gift", "tone": "formal", "prompt": "Sea"},
+     {"style": "haiku", "mood": "happy", "purpose": "a gift", "tone": "formal", "prompt": "Sea"}),
+    ({"style": 3, "rhyme": "yes"}, {}),
+    ({}, {}),
+])
+def test_only_fields_that_pass_validation_are_kept(details, valid):
+    assert valid_details(details) == valid
@@ -0,0 +1,116 @@
+import json
+import re
+import threading
+from types import SimpleNamespace
+import pytest
+
+pytest.importorskip("openai")
+
+import metrics
+import question_batcher
+from context_window import PoemContext
+from question_batcher import answer_queries, answer_questions
+
+
+@pytest.fixture(autouse=True)
+def short_wait(monkeypatch):
+    monkeypatch.setattr(question_batcher, "BATCH_WAIT", 0.05)
+
+
+class _Model:
+    def __init__(self, reply=None):
+        self.reply = reply
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def __call__(self, messages, **kwargs):
+        with self._lock:
+            self.calls.append(messages[-1]["content"])
+        if "response_format" in kwargs:
+            count = int(re.search(r"following (\d+) questions", self.calls[-1]).group(1))
+            content = self.reply or json.dumps({"answers": [f"answer {n}" for n in range(count)]})
+        else:
+            content = "single answer"
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))], usage=None)
+
+
+def test_one_question_is_one_call():
+    model = _Model()
+    assert answer_questions("poem", "What is the meter?", PoemContext("system"), call=model) == "single answer"
+    assert len(model.calls) == 1
+
+
+def test_several_question_marks_in_one_message_are_one_question():
+    model = _Model()
+    answer = answer_questions("poem", "Who is the speaker? What is the meter?", PoemContext("system"), call=model)
+
+    assert answer == "single answer"
+    assert model.calls == ["Who is the speaker? What is the meter?"]
+
+
+def _ask_together(questions, contexts, model):
+    answers = [None] * len(questions)
+    start = threading.Barrier(len(questions))
+
+    def ask(number):
+        start.wait()
+        answers[number] = answer_questions("poem", questions[number], contexts[number], call=model)
+
+    threads = [threading.Thread(target=ask, args=(number,)) for number in range(len(questions))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return answers
+
+
+def test_messages_sent_within_the_wait_share_a_call(monkeypatch):
+    monkeypatch.setattr(question_batcher, "BATCH_WAIT", 1)
+    model = _Model()
+    context = PoemContext("system")
+    context.use_poem(0)
+    waits = metrics.sample_count("batch.wait")
+
+    answers = _ask_together(["What is the meter?", "Who is the speaker?"], [context, context], model)
+
+    assert len(model.calls) == 1
+    assert sorted(answers) == ["answer 0", "answer 1"]
+    assert metrics.sample_count("batch.wait") == waits + 2
+
+
+def test_other_sessions_do_not_share_a_batch():
+    model = _Model()
+    first, second = PoemContext("system"), PoemContext("system")
+    first.use_poem(0)
+    second.use_poem(0)
+
+    assert _ask_together(["What is the meter?", "Who is the speaker?"], [first, second], model) == ["single answer"] * 2
+    assert len(model.calls) == 2
+
+
+def test_unparseable_answers_fall_back_to_one_call_per_question():
+    model = _Model(reply="not json")
+    answers = answer_queries("poem", ["Who is the speaker?", "What is the meter?"], PoemContext("system"), call=model)
+
+    assert answers == ["single answer"] * 2
+    assert len(model.calls) == 3
+
+
+def test_queries_routed_from_one_message_share_a_call():
+    model = _Model()
+    context = PoemContext("system")
+    answers = answer_queries("poem", ["What is the meter?", "Who is the speaker? Why?"], context, call=model)
+
+    assert len(model.calls) == 1
+    assert answers == ["answer 0", "answer 1"]
+    assert [question for question, _ in context.turns] == ["What is the meter?", "Who is the speaker? Why?"]
+
+
+def test_full_batches_are_sent_without_waiting(monkeypatch):
+    monkeypatch.setattr(question_batcher, "BATCH_SIZE", 2)
+    monkeypatch.setattr(question_batcher, "BATCH_WAIT", 30)
+    model = _Model()
+    answers = answer_queries("poem", ["One?", "Two?", "Three?", "Four?"], PoemContext("system"), call=model)
+
+    assert answers == ["answer 0", "answer 1", "answer 0", "answer 1"]
+    assert len(model.calls) == 2
@@ -0,0 +1,21 @@
+import os
+import time
+import uuid
+import session_store
+from session_store import SessionStore
+
+
+def test_saves_prune_expired_snapshots(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_store, "PRUNE_EVERY", 3)
+    store = SessionStore(str(tmp_path))
+    expired, live = str(uuid.uuid4()), str(uuid.uuid4())
+    store.save(expired, {}, {"log": ["old"]})
+    week_ago = time.time() - session_store.SESSION_TTL - 1
+    os.utime(store.path(expired), (week_ago, week_ago))
+
+    snapshot = store.save(live, {}, {"log": ["hi"]})
+    assert os.path.exists(store.path(expired))
+    store.save(live, snapshot, {"log": ["hi", "again"]})
+
+    assert not os.path.exists(store.path(expired))
+    assert store.load(live) == {"log": ["hi", "again"]}
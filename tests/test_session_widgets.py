@@ -0,0 +1,91 @@
+import pytest
+
+pytest.importorskip("streamlit")
+
+import job_widgets
+import session_widgets
+from session_store import SessionStore
+
+
+class _SessionState(dict):
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        self[name] = value
+
+
+class _Streamlit:
+    def __init__(self, query_params=None):
+        self.session_state = _SessionState()
+        self.query_params = dict(query_params or {})
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    store = SessionStore(str(tmp_path))
+    monkeypatch.setattr(session_widgets, "_store", store)
+    return store
+
+
+def _connect(monkeypatch, query_params=None):
+    st = _Streamlit(query_params)
+    monkeypatch.setattr(session_widgets, "st", st)
+    monkeypatch.setattr(job_widgets, "st", st)
+    return st
+
+
+def test_appends_to_session_lists_are_saved(store, monkeypatch):
+    st = _connect(monkeypatch)
+    session_widgets.restore_session({})
+    st.session_state.conversation_log = []
+    for number in range(3):
+        st.session_state.conversation_log.append({"role": "user", "content": f"question {number}"})
+        session_widgets.save_session(["conversation_log"])
+
+    assert store.load(st.query_params["session"]) == {
+        "conversation_log": [{"role": "user", "content": f"question {number}"} for number in range(3)]
+    }
+
+
+def test_restored_session_keeps_saving_changes(store, monkeypatch):
+    st = _connect(monkeypatch)
+    session_widgets.restore_session({})
+    st.session_state.conversation_log = [{"role": "user", "content": "first"}]
+    session_widgets.save_session(["conversation_log"])
+
+    st = _connect(monkeypatch, st.query_params)
+    session_widgets.restore_session({})
+    assert st.session_state.conversation_log == [{"role": "user", "content": "first"}]
+    st.session_state.conversation_log.append({"role": "user", "content": "second"})
+    session_widgets.save_session(["conversation_log"])
+
+    assert store.load(st.query_params["session"])["conversation_log"] == [
+        {"role": "user", "content": "first"},
+        {"role": "user", "content": "second"},
+    ]
+
+
+def test_tabs_opened_from_one_link_write_separately(store, monkeypatch):
+    st = _connect(monkeypatch)
+    session_widgets.restore_session({})
+    st.session_state.conversation_log = [{"role": "user", "content": "shared"}]
+    session_widgets.save_session(["conversation_log"])
+    link = dict(st.query_params)
+
+    tabs = []
+    for content in ("left", "right"):
+        tab = _connect(monkeypatch, link)
+        session_widgets.restore_session({})
+        tab.session_state.conversation_log.append({"role": "user", "content": content})
+        session_widgets.save_session(["conversation_log"])
+        tabs.append(tab)
+
+    left, right = (tab.query_params["session"] for tab in tabs)
+    assert len({link["session"], left, right}) == 3
+    assert [m["content"] for m in store.load(left)["conversation_log"]] == ["shared", "left"]
+    assert [m["content"] for m in store.load(right)["conversation_log"]] == ["shared", "right"]
+    assert [m["content"] for m in store.load(link["session"])["conversation_log"]] == ["shared"]
@@ -0,0 +1,148 @@
+import threading
+import time
+import pytest
+import usage_ledger
+from usage_ledger import UsageLedger
+
+
+@pytest.fixture(autouse=True)
+def budgets(monkeypatch):
+    monkeypatch.setattr(usage_ledger, "SESSION_REQUESTS_PER_MINUTE", 3)
+    monkeypatch.setattr(usage_ledger, "SESSION_TOKENS_PER_MINUTE", 1000)
+    monkeypatch.setattr(usage_ledger, "GLOBAL_REQUESTS_PER_MINUTE", 4)
+    monkeypatch.setattr(usage_ledger, "GLOBAL_TOKENS_PER_MINUTE", 2000)
+
+
+def test_optional_requests_are_only_admitted_when_there_is_room():
+    ledger = UsageLedger()
+    for _ in range(3):
+        assert ledger.try_admit("heavy", "op", 10) is not None
+    assert ledger.try_admit("heavy", "op", 10) is None
+    assert ledger.try_admit("light", "op", 10) is not None
+    assert ledger.try_admit("light", "op", 10) is None
+    assert ledger.usage()["requests"] == 4
+
+
+def _waiter(ledger, session_id, tokens=10):
+    waiter = usage_ledger._Waiter(session_id, tokens)
+    ledger._waiters.append(waiter)
+    return waiter
+
+
+def _fill(ledger, session_id, requests, tokens=10):
+    for _ in range(requests):
+        ledger.try_admit(session_id, "op", tokens)
+
+
+def test_lightest_session_goes_first():
+    ledger = UsageLedger()
+    _fill(ledger, "heavy", 2)
+    _fill(ledger, "light", 1)
+    heavy = _waiter(ledger, "heavy")
+    light = _waiter(ledger, "light")
+
+    assert ledger._is_next(light)
+    assert not ledger._is_next(heavy)
+
+
+def test_session_over_its_budget_does_not_hold_up_others():
+    ledger = UsageLedger()
+    _fill(ledger, "heavy", 3)
+    heavy = _waiter(ledger, "heavy")
+    other = _waiter(ledger, "other", tokens=500)
+
+    assert not ledger._is_next(heavy)
+    assert ledger._is_next(other)
+
+
+def test_nobody_goes_while_the_global_budget_is_used_up():
+    ledger = UsageLedger()
+    _fill(ledger, "a", 2)
+    _fill(ledger, "b", 2)
+    waiter = _waiter(ledger, "c")
+
+    assert not ledger._is_next(waiter)
+
+
+def test_request_larger_than_a_budget_is_rejected():
+    with pytest.raises(usage_ledger.BudgetExceeded) as error:
+        UsageLedger().admit("a", "op", 1001)
+    assert error.value.scope == "request"
+
+
+def test_session_that_cannot_get_room_in_time_is_rejected_at_once(monkeypatch):
+    monkeypatch.setattr(usage_ledger, "MAX_QUEUE_WAIT", 5)
+    ledger = UsageLedger()
+    _fill(ledger, "heavy", 3)
+
+    with pytest.raises(usage_ledger.BudgetExceeded) as error:
+        ledger.admit("heavy", "op", 10)
+    assert error.value.scope == "session" and error.value.retry_after > 5
+
+
+def test_session_with_too_many_waiting_requests_is_rejected(monkeypatch):
+    monkeypatch.setattr(usage_ledger, "MAX_QUEUED_PER_SESSION", 1)
+    ledger = UsageLedger()
+    _waiter(ledger, "busy")
+
+    with pytest.raises(usage_ledger.BudgetExceeded):
+        ledger.admit("busy", "op", 10)
+
+
+def test_waiting_request_is_rejected_after_the_queue_wait(monkeypatch):
+    monkeypatch.setattr(usage_ledger, "MAX_QUEUE_WAIT", 0.2)
+    monkeypatch.setattr(usage_ledger, "POLL_INTERVAL", 0.05)
+    ledger = UsageLedger()
+    _fill(ledger, "a", 2)
+    _fill(ledger, "b", 2)
+
+    with pytest.raises(usage_ledger.BudgetExceeded) as error:
+        ledger.admit("c", "op", 10)
+    assert error.value.scope == "global"
+
+
+def test_cancelled_waiting_request_returns_none(monkeypatch):
+    monkeypatch.setattr(usage_ledger, "POLL_INTERVAL", 0.05)
+    ledger = UsageLedger()
+    _fill(ledger, "a", 2)
+    _fill(ledger, "b", 2)
+    cancelled = threading.Event()
+    cancelled.set()
+
+    assert ledger.admit("c", "op", 10, cancelled) is None
+    assert not ledger._waiters
+
+
+def test_full_waiting_room_turns_away_the_heaviest_session(monkeypatch):
+    monkeypatch.setattr(usage_ledger, "MAX_WAITING", 1)
+    monkeypatch.setattr(usage_ledger, "POLL_INTERVAL", 0.05)
+    ledger = UsageLedger()
+    _fill(ledger, "heavy", 2)
+    _fill(ledger, "light", 1)
+    blocker = ledger.try_admit("other", "op", 900)
+    outcomes = {}
+
+    def admit(session_id):
+        try:
+            outcomes[session_id] = ledger.admit(session_id, "op", 10)
+        except usage_ledger.BudgetExceeded as error:
+            outcomes[session_id] = error
+
+    heavy = threading.Thread(target=admit, args=("heavy",))
+    heavy.start()
+    while not ledger._waiters:
+        time.sleep(0.01)
+
+    # A newcomer heavier than every waiter is the one turned away
+    with pytest.raises(usage_ledger.BudgetExceeded):
+        ledger.admit("other", "op", 10)
+
+    # A lighter newcomer takes the heaviest waiter's place
+    light = threading.Thread(target=admit, args=("light",))
+    light.start()
+    heavy.join(timeout=2)
+    ledger.release(blocker)
+    light.join(timeout=2)
+
+    assert isinstance(outcomes["heavy"], usage_ledger.BudgetExceeded)
+    assert isinstance(outcomes["light"], usage_ledger.Reservation)
@@ -0,0 +1,234 @@
+import os
+import threading
+import time
+from collections import deque
+import jobs
+import metrics
+from context_window import message_tokens
+
+# Budgets are per rolling window of this many seconds, i.e. tokens and requests per minute
+WINDOW_SECONDS = 60
+
+# What one browser session may use, so a single user cannot eat the rate limit for everyone
+SESSION_TOKENS_PER_MINUTE = int(os.getenv("SUBLIME_SESSION_TPM", "40000"))
+SESSION_REQUESTS_PER_MINUTE = int(os.getenv("SUBLIME_SESSION_RPM", "20"))
+
+# What the whole process may use; keep it below the account's rate limit
+GLOBAL_TOKENS_PER_MINUTE = int(os.getenv("SUBLIME_GLOBAL_TPM", "300000"))
+GLOBAL_REQUESTS_PER_MINUTE = int(os.getenv("SUBLIME_GLOBAL_RPM", "200"))
+
+# Longest a request waits in the admission queue before it is rejected
+MAX_QUEUE_WAIT = float(os.getenv("SUBLIME_ADMISSION_WAIT", "15"))
+
+# Requests one session may have waiting at once; more are rejected right away
+MAX_QUEUED_PER_SESSION = int(os.getenv("SUBLIME_MAX_QUEUED", "2"))
+
+# Requests that may wait at once in the whole process. Waiting holds a worker of the shared job pool,
+# so this stays below jobs.MAX_WORKERS and the remaining workers keep running other sessions' jobs
+MAX_WAITING = int(os.getenv("SUBLIME_MAX_WAITING", str(max(jobs.MAX_WORKERS // 2, 1))))
+
+# Completion tokens assumed for an operation until its replies have been measured
+DEFAULT_COMPLETION_TOKENS = 500
+
+# How often a waiting request rechecks the window, which frees up as old usage expires
+POLL_INTERVAL = 0.2
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+# Raised instead of calling the upstream when a budget will not allow the request in time
+class BudgetExceeded(Exception):
+    def __init__(self, scope, retry_after):
+        super().__init__(f"The {scope} usage budget is used up, retry in {retry_after:.0f}s")
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+# One admitted request; its token estimate is replaced by the real usage once the reply arrives
+class Reservation:
+    def __init__(self, session_id, operation, tokens):
+        self.session_id = session_id
+        self.operation = operation
+        self.tokens = tokens
+        self.admitted_at = time.monotonic()
+
+
+class _Waiter:
+    def __init__(self, session_id, tokens):
+        self.session_id = session_id
+        self.tokens = tokens
+        self.arrived_at = time.monotonic()
+        self.queued = False
+        self.evicted = False
+
+
+# Tokens and requests used over the last minute, per session and for the process, with
+# admission control: requests past a budget wait their turn or are rejected
+class UsageLedger:
+    def __init__(self):
+        self._reservations = deque()
+        self._waiters = []
+        self._condition = threading.Condition()
+
+    # Function to admit a request of about `tokens` tokens for a session, waiting for room when a
+    # budget is used up; returns None if cancel_event is set while waiting
+    def admit(self, session_id, operation, tokens, cancel_event=None):
+        with self._condition:
+            self._trim(time.monotonic())
+            self._check_admissible(session_id, tokens)
+            waiter = _Waiter(session_id, tokens)
+            self._waiters.append(waiter)
+            try:
+                while not self._is_next(waiter):
+                    waited = time.monotonic() - waiter.arrived_at
+                    if waited >= MAX_QUEUE_WAIT or waiter.evicted:
+                        metrics.incr("admission.rejected")
+                        raise BudgetExceeded(*self._limiting_scope(session_id, tokens))
+                    if cancel_event is not None and cancel_event.is_set():
+                        return None
+                    if not waiter.queued:
+                        waiter.queued = True
+                        metrics.incr("admission.queued")
+                    self._condition.wait(min(POLL_INTERVAL, MAX_QUEUE_WAIT - waited))
+                    self._trim(time.monotonic())
+            finally:
+                self._waiters.remove(waiter)
+                self._condition.notify_all()
+            metrics.observe("admission.wait", time.monotonic() - waiter.arrived_at)
+            return self._reserve(session_id, operation, tokens)
+
+    # Function to admit a request only if it fits right now and nobody is waiting, e.g. an optional
+    # hedged duplicate that is simply not sent otherwise; returns None when it does not fit
+    def try_admit(self, session_id, operation, tokens):
+        with self._condition:
+            self._trim(time.monotonic())
+            if self._waiters or not self._session_has_room(session_id, tokens) or not self._global_has_room(tokens):
+                return None
+            return self._reserve(session_id, operation, tokens)
+
+    # Function to replace a reservation's estimate with the tokens the reply actually used
+    def settle(self, reservation, usage):
+        metrics.incr("usage.prompt_tokens", usage.prompt_tokens)
+        metrics.incr("usage.completion_tokens", usage.completion_tokens)
+        metrics.observe(f"usage.{reservation.operation}.completion_tokens", usage.completion_tokens)
+        with self._condition:
+            reservation.tokens = usage.total_tokens
+            self._condition.notify_all()
+
+    # Function to give back a reservation whose request was never sent, e.g. the breaker refused it
+    def release(self, reservation):
+        with self._condition:
+            if reservation in self._reservations:
+                self._reservations.remove(reservation)
+            self._condition.notify_all()
+
+    # Function to read the last minute's usage for the process and, optionally, one session
+    def usage(self, session_id=None):
+        with self._condition:
+            self._trim(time.monotonic())
+            state = {
+                "tokens": sum(r.tokens for r in self._reservations),
+                "requests": len(self._reservations),
+                "queued": len(self._waiters),
+            }
+            if session_id is not None:
+                state["session_tokens"], state["session_requests"] = self._session_usage(session_id)
+            return state
+
+    # Rejects up front what could never fit, or would not fit within MAX_QUEUE_WAIT anyway
+    def _check_admissible(self, session_id, tokens):
+        if tokens > SESSION_TOKENS_PER_MINUTE or tokens > GLOBAL_TOKENS_PER_MINUTE:
+            metrics.incr("admission.rejected")
+            raise BudgetExceeded("request", WINDOW_SECONDS)
+        waiting = [waiter for waiter in self._waiters if not waiter.evicted]
+        if sum(1 for waiter in waiting if waiter.session_id == session_id) >= MAX_QUEUED_PER_SESSION:
+            metrics.incr("admission.rejected")
+            raise BudgetExceeded(*self._limiting_scope(session_id, tokens))
+        if len(waiting) >= MAX_WAITING:
+            # The waiting room is full: a lighter session takes the place of the heaviest waiter,
+            # otherwise the newcomer is the one turned away
+            usage = {waiter.session_id: self._session_usage(waiter.session_id)[0] for waiter in waiting}
+            heaviest = max(waiting, key=lambda waiter: (usage[waiter.session_id], waiter.arrived_at))
+            if usage[heaviest.session_id] <= self._session_usage(session_id)[0]:
+                metrics.incr("admission.rejected")
+                raise BudgetExceeded(*self._limiting_scope(session_id, tokens))
+            heaviest.evicted = True
+            self._condition.notify_all()
+        session = [r for r in self._reservations if r.session_id == session_id]
+        retry_after = _time_until_room(session, SESSION_REQUESTS_PER_MINUTE, SESSION_TOKENS_PER_MINUTE, tokens)
+        if retry_after > MAX_QUEUE_WAIT:
+            metrics.incr("admission.rejected")
+            raise BudgetExceeded("session", retry_after)
+
+    # Fair queueing: of the waiters whose own session has room, the session that used the fewest
+    # tokens this minute goes first, so heavy sessions cannot starve light ones
+    def _is_next(self, waiter):
+        candidates = [w for w in self._waiters if not w.evicted and self._session_has_room(w.session_id, w.tokens)]
+        if waiter not in candidates:
+            return False
+        usage = {w.session_id: self._session_usage(w.session_id)[0] for w in candidates}
+        first = min(candidates, key=lambda w: (usage[w.session_id], w.arrived_at))
+        return first is waiter and self._global_has_room(waiter.tokens)
+
+    def _reserve(self, session_id, operation, tokens):
+        reservation = Reservation(session_id, operation, tokens)
+        self._reservations.append(reservation)
+        metrics.incr("usage.requests")
+        return reservation
+
+    def _session_usage(self, session_id):
+        session = [r for r in self._reservations if r.session_id == session_id]
+        return sum(r.tokens for r in session), len(session)
+
+    def _session_has_room(self, session_id, tokens):
+        used, requests = self._session_usage(session_id)
+        return requests < SESSION_REQUESTS_PER_MINUTE and used + tokens <= SESSION_TOKENS_PER_MINUTE
+
+    def _global_has_room(self, tokens):
+        used = sum(r.tokens for r in self._reservations)
+        return len(self._reservations) < GLOBAL_REQUESTS_PER_MINUTE and used + tokens <= GLOBAL_TOKENS_PER_MINUTE
+
+    def _limiting_scope(self, session_id, tokens):
+        session = [r for r in self._reservations if r.session_id == session_id]
+        session_wait = _time_until_room(session, SESSION_REQUESTS_PER_MINUTE, SESSION_TOKENS_PER_MINUTE, tokens)
+        global_wait = _time_until_room(self._reservations, GLOBAL_REQUESTS_PER_MINUTE, GLOBAL_TOKENS_PER_MINUTE, tokens)
+        if session_wait >= global_wait:
+            return "session", max(session_wait, POLL_INTERVAL)
+        return "global", max(global_wait, POLL_INTERVAL)
+
+    def _trim(self, now):
+        while self._reservations and now - self._reservations[0].admitted_at >= WINDOW_SECONDS:
+            self._reservations.popleft()
+
+
+# Function to work out how long until enough of the oldest reservations expire for one more
+# request of `tokens` tokens; 0 if it fits now
+def _time_until_room(reservations, requests_limit, tokens_limit, tokens):
+    requests = len(reservations)
+    used = sum(r.tokens for r in reservations)
+    if requests < requests_limit and used + tokens <= tokens_limit:
+        return 0
+    now = time.monotonic()
+    for reservation in reservations:
+        requests -= 1
+        used -= reservation.tokens
+        if requests < requests_limit and used + tokens <= tokens_limit:
+            return max(reservation.admitted_at + WINDOW_SECONDS - now, 0)
+    return WINDOW_SECONDS
+
+
+# Function to estimate the tokens a request will use: its prompt, plus the completion tokens
+# the operation's recent replies used (or max_tokens, when the request caps it)
+def estimate_tokens(operation, messages, max_tokens=None):
+    completion = max_tokens or metrics.percentile(f"usage.{operation}.completion_tokens", 90) or DEFAULT_COMPLETION_TOKENS
+    return message_tokens(messages) + completion
+
+
+# Function to get the ledger shared by every session in the process
+def get_ledger():
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = UsageLedger()
+        return _ledger